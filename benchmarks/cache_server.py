@@ -0,0 +1,171 @@
+"""
+    Local stand-in for the spacetime cache server. Serves a synthetic web
+    graph or recorded pages with the cbor protocol utils.download expects:
+    GET /?q=<url>&u=<user agent> returns {"url", "status", "response"}
+    where response is a pickled requests.Response.
+"""
+
+import os
+import json
+import time
+import random
+import pickle
+from itertools import accumulate
+from argparse import ArgumentParser
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+import cbor
+import requests
+
+DEFAULT_PORT = 9100
+HOSTS = 20 # synthetic hosts, pages are spread evenly over them
+PAGES_PER_HOST = 50
+LINKS_PER_PAGE = 12
+SAME_HOST_LINKS = 0.8 # share of a page's links that stay on its host
+BROKEN_LINKS = 0.02 # share of links to pages that do not exist
+WORDS_PER_PAGE = 300
+VOCABULARY = 20000
+
+class SyntheticWeb:
+    """
+    Deterministic web graph: a page's words and links come from a random
+    generator seeded with the graph seed and the url, so any page can be
+    served without storing the graph and every run sees the same web.
+    """
+    def __init__(self, hosts: int = HOSTS, pages: int = PAGES_PER_HOST, links: int = LINKS_PER_PAGE,
+                 words: int = WORDS_PER_PAGE, seed: int = 0):
+        self.hosts = [f"host{i}.ics.uci.edu" for i in range(hosts)]
+        self.pages = pages
+        self.links = links
+        self.words = words
+        self.seed = seed
+        # zipf like word choice, real pages repeat common words
+        self.cum_weights = list(accumulate(1 / (rank + 1) for rank in range(VOCABULARY)))
+        self.vocabulary = [f"term{rank}" for rank in range(VOCABULARY)]
+
+    def url(self, host: str, page: int) -> str:
+        return f"https://{host}/doc{page}"
+
+    def seeds(self) -> list:
+        return [self.url(host, 0) for host in self.hosts]
+
+    def __len__(self):
+        return len(self.hosts) * self.pages
+
+    def page(self, url: str):
+        """
+        The page's html, or None if url is not part of the graph
+        """
+        parts = urlsplit(url)
+        if parts.netloc not in self.hosts or not parts.path.startswith("/doc"):
+            return None
+        try:
+            page = int(parts.path[4:])
+        except ValueError:
+            return None
+        if not 0 <= page < self.pages:
+            return None
+
+        rng = random.Random(f"{self.seed}:{url}")
+        text = " ".join(rng.choices(self.vocabulary, cum_weights=self.cum_weights, k=self.words))
+        links = []
+        for _ in range(self.links):
+            host = parts.netloc if rng.random() < SAME_HOST_LINKS else rng.choice(self.hosts)
+            target = rng.randrange(self.pages)
+            if rng.random() < BROKEN_LINKS:
+                target += self.pages
+            links.append(f'<a href="{self.url(host, target)}">{target}</a>')
+        return (f"<html><head><title>{url}</title><script>var page = 1;</script></head>"
+                f"<body><p>{text}</p><div>{' '.join(links)}</div></body></html>").encode("utf-8")
+
+class RecordedWeb:
+    """
+    Pages saved by a crawl, one json file per page with "url" and "content"
+    as in the corpus build_index.py reads.
+    """
+    def __init__(self, root: str):
+        self.paths = {}
+        for folder, _, files in os.walk(root):
+            for filename in files:
+                path = os.path.join(folder, filename)
+                with open(path, 'r') as f:
+                    self.paths[json.load(f).get("url", "")] = path
+
+    def seeds(self) -> list:
+        return sorted(self.paths)[:1]
+
+    def __len__(self):
+        return len(self.paths)
+
+    def page(self, url: str):
+        path = self.paths.get(url)
+        if path is None:
+            return None
+        with open(path, 'r') as f:
+            return json.load(f).get("content", "").encode("utf-8")
+
+def cache_reply(url: str, html) -> bytes:
+    if html is None:
+        return cbor.dumps({"url": url, "status": 404, "error": f"{url} is not in the cache."})
+    resp = requests.models.Response()
+    resp._content = html
+    resp.status_code = 200
+    resp.url = url
+    resp.encoding = "utf-8"
+    resp.headers["Content-Type"] = "text/html; charset=utf-8"
+    return cbor.dumps({"url": url, "status": 200, "response": pickle.dumps(resp)})
+
+def make_handler(web, latency: float):
+    class CacheHandler(BaseHTTPRequestHandler):
+        # keep-alive, like the pooled clients in utils.download
+        protocol_version = "HTTP/1.1"
+        # headers and body are separate sends, with Nagle the body waits for
+        # the client's delayed ack and every keep-alive request costs ~40ms
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            query = parse_qs(urlsplit(self.path).query)
+            url = query.get("q", [""])[0]
+            if latency:
+                time.sleep(latency)
+            body = cache_reply(url, web.page(url))
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return CacheHandler
+
+class CacheServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024 # hundreds of asyncio fetches connect at once
+
+def make_server(web, port: int = DEFAULT_PORT, latency: float = 0.0):
+    return CacheServer(("127.0.0.1", port), make_handler(web, latency))
+
+def make_web(args):
+    if args.recorded:
+        return RecordedWeb(args.recorded)
+    return SyntheticWeb(args.hosts, args.pages, args.links, args.words, args.seed)
+
+def add_web_arguments(parser: ArgumentParser):
+    parser.add_argument("--recorded", type=str, default=None, help="folder of saved json pages")
+    parser.add_argument("--hosts", type=int, default=HOSTS)
+    parser.add_argument("--pages", type=int, default=PAGES_PER_HOST, help="pages per host")
+    parser.add_argument("--links", type=int, default=LINKS_PER_PAGE)
+    parser.add_argument("--words", type=int, default=WORDS_PER_PAGE)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds per request")
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    add_web_arguments(parser)
+    args = parser.parse_args()
+    web = make_web(args)
+    print(f"Serving {len(web)} pages on 127.0.0.1:{args.port}, seeds: {','.join(web.seeds())}")
+    make_server(web, args.port, args.latency).serve_forever()
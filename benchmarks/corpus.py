@@ -0,0 +1,103 @@
+"""
+    Seeded synthetic corpus in the DEV layout build_index.py reads:
+    <root>/<host>/<n>.json with {"url", "content", "encoding"}
+
+    python -m benchmarks.corpus --root /tmp/DEV --docs 5000
+"""
+
+import os
+import json
+import math
+import random
+from itertools import accumulate
+from argparse import ArgumentParser
+
+DOCS = 2000
+HOSTS = 20
+VOCABULARY = 50000
+ZIPF_EXPONENT = 1.07 # close to what English text shows
+MEAN_WORDS = 400 # document lengths are log-normal around this
+LINKS_PER_DOC = 10
+SYLLABLES = ["ba", "co", "de", "fi", "gu", "ha", "ji", "ka", "lo", "mu", "ne", "po", "qui",
+             "ra", "se", "ti", "vo", "wa", "xe", "zo", "str", "ing", "tion", "er", "al"]
+SUFFIXES = ["", "", "", "s", "ing", "ed", "ly", "ation", "ness", "er"]
+
+def make_vocabulary(size: int, rng: random.Random) -> list[str]:
+    """
+    Distinct made up words, some with English suffixes so the stemmer
+    folds them like real text
+    """
+    words = []
+    seen = set()
+    while len(words) < size:
+        word = "".join(rng.choices(SYLLABLES, k=rng.randint(1, 4))) + rng.choice(SUFFIXES)
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    return words
+
+class CorpusGenerator:
+    """
+    Word ranks follow a Zipf distribution, so a few terms have very long
+    postings lists and most have short ones, as in the DEV corpus.
+    """
+    def __init__(self, docs: int = DOCS, hosts: int = HOSTS, vocabulary: int = VOCABULARY,
+                 mean_words: int = MEAN_WORDS, seed: int = 0):
+        self.docs = docs
+        self.hosts = [f"host{i}.ics.uci.edu" for i in range(hosts)]
+        self.mean_words = mean_words
+        self.seed = seed
+        rng = random.Random(seed)
+        self.vocabulary = make_vocabulary(vocabulary, rng)
+        self.cum_weights = list(accumulate(1 / (rank + 1) ** ZIPF_EXPONENT for rank in range(vocabulary)))
+
+    def url(self, n: int) -> str:
+        return f"https://{self.hosts[n % len(self.hosts)]}/page/{n}"
+
+    def words(self, rng: random.Random, k: int) -> list[str]:
+        return rng.choices(self.vocabulary, cum_weights=self.cum_weights, k=k)
+
+    def document(self, n: int) -> dict:
+        rng = random.Random(f"{self.seed}:{n}")
+        length = max(20, int(rng.lognormvariate(math.log(self.mean_words), 0.6)))
+        words = self.words(rng, length)
+        paragraphs = [" ".join(words[i:i + 60]) for i in range(0, len(words), 60)]
+        links = " ".join(f'<a href="{self.url(rng.randrange(self.docs))}">{rng.choice(words)}</a>'
+                         for _ in range(LINKS_PER_DOC))
+        title = " ".join(words[:5]).title()
+        content = (f"<html><head><title>{title}</title><style>p {{ margin: 0 }}</style>"
+                   f"<script>var n = {n};</script></head><body><h1>{title}</h1>"
+                   + "".join(f"<p>{p}</p>" for p in paragraphs)
+                   + f"<nav>{links}</nav></body></html>")
+        return {"url": self.url(n), "content": content, "encoding": "utf-8"}
+
+    def query(self, rng: random.Random) -> str:
+        """
+        One to three words drawn by frequency, like real queries mixing
+        common and rare terms
+        """
+        return " ".join(self.words(rng, rng.randint(1, 3)))
+
+    def write(self, root: str) -> list[str]:
+        paths = []
+        for n in range(self.docs):
+            folder = os.path.join(root, self.hosts[n % len(self.hosts)])
+            if not os.path.exists(folder):
+                os.makedirs(folder)
+            path = os.path.join(folder, f"{n:06d}.json")
+            with open(path, 'w') as f:
+                json.dump(self.document(n), f)
+            paths.append(path)
+        return paths
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--root", type=str, required=True)
+    parser.add_argument("--docs", type=int, default=DOCS)
+    parser.add_argument("--hosts", type=int, default=HOSTS)
+    parser.add_argument("--vocabulary", type=int, default=VOCABULARY)
+    parser.add_argument("--mean-words", type=int, default=MEAN_WORDS)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    generator = CorpusGenerator(args.docs, args.hosts, args.vocabulary, args.mean_words, args.seed)
+    print(f"Wrote {len(generator.write(args.root))} documents to {args.root}")
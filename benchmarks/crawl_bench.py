@@ -0,0 +1,189 @@
+"""
+    Crawl throughput benchmark against the local cache server stand-in.
+    Reports pages/sec, per page latency percentiles and frontier growth.
+
+    python -m benchmarks.crawl_bench --threads 8 --politeness 0.1 --latency 0.05
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import logging
+import tempfile
+import subprocess
+from threading import Thread, Event
+from argparse import ArgumentParser
+from configparser import ConfigParser
+
+from utils.config import Config
+from crawler import Crawler
+from crawler.frontier import Frontier, AsyncFrontier
+from crawler.worker import Worker, AsyncWorker
+from utils.metrics import metrics
+from benchmarks.cache_server import DEFAULT_PORT, add_web_arguments, make_web
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_INTERVAL = 0.5 # seconds between frontier samples
+SERVER_START_TIMEOUT = 30.0
+
+class TimedFrontierMixin:
+    """
+    Records when each url leaves the frontier and when it is marked
+    complete, the time in between is its download plus scrape latency.
+    """
+    def __init__(self, config, restart):
+        self.started = dict()
+        self.latencies = list()
+        super().__init__(config, restart)
+
+    def _pop_ready(self):
+        url, wait = super()._pop_ready()
+        if url:
+            self.started[url] = time.perf_counter()
+        return url, wait
+
+    def mark_url_complete(self, url):
+        super().mark_url_complete(url)
+        with self.lock:
+            start = self.started.pop(url, None)
+            if start is not None:
+                self.latencies.append(time.perf_counter() - start)
+
+    def sample(self):
+        with self.lock:
+            queued = sum(len(queue) for queue in self.host_queues.values())
+            return len(self.latencies), queued, len(self.seen)
+
+class TimedFrontier(TimedFrontierMixin, Frontier):
+    pass
+
+class TimedAsyncFrontier(TimedFrontierMixin, AsyncFrontier):
+    pass
+
+def percentile(values: list, p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+def start_server(args):
+    """
+    The server runs in its own process so it does not share the GIL with the crawler
+    """
+    command = [sys.executable, "-m", "benchmarks.cache_server", "--port", str(args.port),
+               "--hosts", str(args.hosts), "--pages", str(args.pages), "--links", str(args.links),
+               "--words", str(args.words), "--seed", str(args.seed), "--latency", str(args.latency)]
+    if args.recorded:
+        command += ["--recorded", args.recorded]
+    server = subprocess.Popen(command, cwd=REPO_DIR, stdout=subprocess.DEVNULL)
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", args.port), timeout=1).close()
+            return server
+        except OSError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError(f"Cache server did not start on port {args.port}")
+
+def make_config(args, seeds: list):
+    cparser = ConfigParser()
+    cparser.read(args.config_file)
+    config = Config(cparser)
+    config.threads_count = args.threads
+    config.time_delay = args.politeness
+    config.async_fetches = args.async_fetches
+    config.seed_urls = seeds
+    config.save_file = "frontier.db"
+    config.cache_server = ("127.0.0.1", args.port)
+    return config
+
+def run_benchmark(args) -> dict:
+    web = make_web(args)
+    config = make_config(args, web.seeds())
+    server = start_server(args)
+    # worker logs, the frontier db and the report stay out of the repo
+    os.chdir(tempfile.mkdtemp(prefix="crawl_bench_"))
+    logging.disable(logging.INFO)
+    metrics.reset()
+    try:
+        if config.async_fetches:
+            crawler = Crawler(config, True, TimedAsyncFrontier, AsyncWorker)
+        else:
+            crawler = Crawler(config, True, TimedFrontier, Worker)
+        frontier = crawler.frontier
+        samples = []
+        done = Event()
+        start = time.perf_counter()
+
+        def sample():
+            while not done.wait(args.sample_interval):
+                samples.append((round(time.perf_counter() - start, 2), *frontier.sample()))
+
+        sampler = Thread(target=sample, daemon=True)
+        sampler.start()
+        crawler.start()
+        elapsed = time.perf_counter() - start
+        done.set()
+        sampler.join()
+        samples.append((round(elapsed, 2), *frontier.sample()))
+    finally:
+        server.kill()
+        server.wait()
+        logging.disable(logging.NOTSET)
+
+    latencies = frontier.latencies
+    return {
+        "threads": args.threads,
+        "politeness": args.politeness,
+        "async_fetches": args.async_fetches,
+        "latency": args.latency,
+        "web_pages": len(web),
+        "pages": len(latencies),
+        "seconds": round(elapsed, 3),
+        "pages_per_sec": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": {f"p{p}": round(1000 * percentile(latencies, p), 2) for p in (50, 90, 99)},
+        "discovered": samples[-1][3],
+        "max_queued": max(s[2] for s in samples),
+        # (seconds, pages done, urls queued, urls discovered)
+        "frontier": samples,
+        "stages": metrics.summary(),
+    }
+
+def print_summary(result: dict):
+    print(f"{result['pages']} pages in {result['seconds']}s: {result['pages_per_sec']} pages/sec "
+          f"({result['threads']} threads, {result['async_fetches']} async fetches, "
+          f"politeness {result['politeness']}s, server latency {result['latency']}s)")
+    latency = result["latency_ms"]
+    print(f"latency ms: p50 {latency['p50']}, p90 {latency['p90']}, p99 {latency['p99']}")
+    print(f"frontier: {result['discovered']} urls discovered, at most {result['max_queued']} queued")
+    print(f"stages: {result['stages'].replace(' | ', chr(10) + '  ')}")
+    samples = result["frontier"]
+    step = max(1, len(samples) // 10)
+    for seconds, done, queued, discovered in samples[::step]:
+        print(f"  {seconds:8.2f}s {done:8d} done {queued:8d} queued {discovered:8d} discovered")
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--config_file", type=str, default=os.path.join(REPO_DIR, "config.ini"))
+    parser.add_argument("--threads", type=int, default=1, help="THREADCOUNT")
+    parser.add_argument("--politeness", type=float, default=0.5, help="POLITENESS in seconds")
+    parser.add_argument("--async-fetches", type=int, default=0, help="ASYNCFETCHES")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--sample-interval", type=float, default=SAMPLE_INTERVAL)
+    parser.add_argument("--json", type=str, default=None, help="also write the results here")
+    add_web_arguments(parser)
+    args = parser.parse_args()
+    args.config_file = os.path.abspath(args.config_file)
+    if args.json:
+        args.json = os.path.abspath(args.json)
+    if args.recorded:
+        args.recorded = os.path.abspath(args.recorded)
+
+    result = run_benchmark(args)
+    print_summary(result)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
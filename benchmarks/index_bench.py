@@ -0,0 +1,240 @@
+"""
+    Index build and query benchmark on a seeded synthetic corpus.
+    Times the full rebuild and each stage on its own: parse, tokenize
+    (with stemming), spill, merge, searcher startup and query latency.
+    --positions builds a positional index and also times phrase queries.
+    --shards N also merges N document range shards and times the same
+    queries through the coordinator's shard processes.
+
+    python -m benchmarks.index_bench --docs 5000 --json result.json --profile profiles/
+    python -m benchmarks.index_bench --baseline result.json   # exits 1 on a regression
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import cProfile
+import tempfile
+from argparse import ArgumentParser
+
+import tokenizer
+from build_index import build_index, collect_paths, get_visible_text, ignore_parser_warnings, INDEX_MEMORY_MB
+from docstore import DocStoreWriter, DOC_STORE_FILE
+from merge import merge_segments, write_segment, clear_segments, positions_path, INDEX_FILE, MERGE_FAN_IN, SHARD_DIR
+from lexicon import LEXICON_FILE
+from posting import add_postings, add_positional_postings
+from search import Searcher, POSTINGS_CACHE_MB
+from coordinator import ShardedSearcher
+from benchmarks.corpus import CorpusGenerator, DOCS, HOSTS, VOCABULARY, MEAN_WORDS
+
+QUERIES = 500
+TOP_K = 10
+TOLERANCE = 0.25 # slowdown against the baseline reported as a regression
+
+def percentile(values: list, p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] if ordered else 0.0
+
+class StageTimer:
+    """
+    Runs each stage once, optionally under cProfile with one .prof per stage
+    """
+    def __init__(self, profile_dir=None):
+        self.profile_dir = profile_dir
+        self.stages = {}
+        if profile_dir and not os.path.exists(profile_dir):
+            os.makedirs(profile_dir)
+
+    def run(self, name: str, func, *args):
+        profiler = cProfile.Profile() if self.profile_dir else None
+        start = time.perf_counter()
+        if profiler:
+            profiler.enable()
+        result = func(*args)
+        if profiler:
+            profiler.disable()
+        self.stages[name] = {"seconds": round(time.perf_counter() - start, 4)}
+        if profiler:
+            profiler.dump_stats(os.path.join(self.profile_dir, f"{name}.prof"))
+        return result
+
+def parse_stage(paths: list) -> list:
+    pages = []
+    for path in paths:
+        with open(path, 'r') as f:
+            page = json.load(f)
+        pages.append((page["url"], get_visible_text(page["content"])))
+    return pages
+
+def tokenize_stage(pages: list, positions: bool) -> list:
+    documents = []
+    for url, text in pages:
+        tokens = tokenizer.tokenize(text)
+        if positions:
+            documents.append((url, len(tokens), tokenizer.compute_stem_positions(tokens)))
+        else:
+            documents.append((url, len(tokens), tokenizer.compute_stem_frequencies(tokens)))
+    return documents
+
+def spill_stage(documents: list, memory_mb: float, positions: bool) -> int:
+    """
+    Same in-memory index, budget and segment writes as build_index's
+    shards. Returns the number of segments.
+    """
+    clear_segments()
+    Index = {}
+    budget = memory_mb * 1024 * 1024
+    estimate = 0
+    segment_num = 0
+    add = add_positional_postings if positions else add_postings
+    with DocStoreWriter(DOC_STORE_FILE) as docs:
+        for url, length, frequency in documents:
+            estimate += add(Index, docs.add(url, length), frequency)
+            if estimate >= budget:
+                segment_num += 1
+                write_segment(Index, f"index_0_{segment_num}", positions)
+                Index.clear()
+                estimate = 0
+        if Index:
+            segment_num += 1
+            write_segment(Index, f"index_0_{segment_num}", positions)
+    tokenizer.stem_cache.save(tokenizer.STEM_TABLE_FILE)
+    return segment_num
+
+def query_stage(searcher, queries: list, positional: bool) -> dict:
+    """
+    Per query latency of ranked (BM25) and boolean AND retrieval, and on a
+    positional index of the same queries quoted as phrases. The result
+    cache is off, so a repeated query is not free.
+    """
+    results = {}
+    modes = ("rank", "and", "phrase") if positional else ("rank", "and")
+    for mode in modes:
+        latencies = []
+        for query in queries:
+            start = time.perf_counter()
+            if mode == "rank":
+                searcher.rank(query, TOP_K)
+            elif mode == "phrase":
+                searcher.search(f'"{query}"')
+            else:
+                searcher.search(query)
+            latencies.append(time.perf_counter() - start)
+        results[mode] = {f"p{p}_ms": round(1000 * percentile(latencies, p), 3) for p in (50, 90, 99)}
+        results[mode]["mean_ms"] = round(1000 * sum(latencies) / len(latencies), 3)
+    return results
+
+def run_benchmark(args) -> dict:
+    generator = CorpusGenerator(args.docs, args.hosts, args.vocabulary, args.mean_words, args.seed)
+    # index files are written to the working directory
+    os.chdir(tempfile.mkdtemp(prefix="index_bench_"))
+    if args.corpus:
+        paths = collect_paths(args.corpus)
+    else:
+        paths = generator.write("DEV")
+    timer = StageTimer(args.profile)
+
+    # end to end, what a rebuild costs
+    tokenizer.stem_cache = tokenizer.StemCache()
+    timer.run("rebuild", lambda: (build_index(paths, args.workers, args.memory_mb, args.positions),
+                                  merge_segments()))
+
+    # the same work one stage at a time, with a cold stem cache
+    tokenizer.stem_cache = tokenizer.StemCache()
+    pages = timer.run("parse", parse_stage, paths)
+    documents = timer.run("tokenize", tokenize_stage, pages, args.positions)
+    segments = timer.run("spill", spill_stage, documents, args.memory_mb, args.positions)
+    timer.stages["spill"]["segments"] = segments
+    timer.run("merge", merge_segments)
+    searcher = timer.run("startup", Searcher, INDEX_FILE, DOC_STORE_FILE, LEXICON_FILE,
+                         args.postings_cache_mb, 0)
+
+    rng = random.Random(args.seed)
+    queries = [generator.query(rng) for _ in range(args.queries)]
+    stages = [("queries", searcher, searcher.lexicon.positional)]
+    if args.shards > 1:
+        timer.run("shard_merge", merge_segments, INDEX_FILE, LEXICON_FILE, MERGE_FAN_IN, args.shards)
+        sharded = timer.run("shard_startup", ShardedSearcher, SHARD_DIR, DOC_STORE_FILE,
+                            args.postings_cache_mb, 0)
+        stages.append(("shard_queries", sharded, sharded.positional))
+
+    for name, stage_searcher, positional in stages:
+        query_start = time.perf_counter()
+        queries_result = timer.run(name, query_stage, stage_searcher, queries, positional)
+        timer.stages[name].update(queries_result)
+        timer.stages[name]["queries"] = len(queries)
+        timer.stages[name]["qps"] = round(len(queries) * len(queries_result)
+                                          / (time.perf_counter() - query_start), 1)
+    if args.shards > 1:
+        sharded.close()
+
+    index_files = [INDEX_FILE, LEXICON_FILE, DOC_STORE_FILE]
+    if args.positions:
+        index_files.append(positions_path(INDEX_FILE))
+    return {
+        "corpus": {"docs": len(paths), "seed": args.seed, "vocabulary": args.vocabulary,
+                   "mean_words": args.mean_words, "source": args.corpus or "synthetic"},
+        "workers": args.workers,
+        "memory_mb": args.memory_mb,
+        "positions": args.positions,
+        "shards": args.shards,
+        "index_kb": round(sum(os.path.getsize(path) for path in index_files) / 1024, 1),
+        "stages": timer.stages,
+    }
+
+def regressions(result: dict, baseline: dict, tolerance: float = TOLERANCE) -> list[str]:
+    """
+    Stage times and p99 query latencies more than tolerance slower than the baseline
+    """
+    found = []
+    checks = [(name, "seconds") for name in result["stages"]]
+    checks += [(stage, mode) for stage in ("queries", "shard_queries") if stage in result["stages"]
+               for mode in ("rank", "and", "phrase")]
+    for stage, key in checks:
+        old = baseline["stages"].get(stage, {}).get(key)
+        new = result["stages"][stage].get(key)
+        if key in ("rank", "and", "phrase"):
+            old = old and old["p99_ms"]
+            new = new and new["p99_ms"]
+            key = f"{key} p99_ms"
+        if old and new and new > old * (1 + tolerance):
+            found.append(f"{stage} {key}: {old} -> {new} (+{new / old - 1:.0%})")
+    return found
+
+if __name__ == "__main__":
+    ignore_parser_warnings()
+    parser = ArgumentParser()
+    parser.add_argument("--docs", type=int, default=DOCS)
+    parser.add_argument("--hosts", type=int, default=HOSTS)
+    parser.add_argument("--vocabulary", type=int, default=VOCABULARY)
+    parser.add_argument("--mean-words", type=int, default=MEAN_WORDS)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--corpus", type=str, default=None, help="existing DEV folder instead of a generated one")
+    parser.add_argument("--workers", type=int, default=1, help="build_index workers for the rebuild")
+    parser.add_argument("--memory-mb", type=float, default=INDEX_MEMORY_MB, help="in-memory index budget")
+    parser.add_argument("--positions", action="store_true", help="positional index, adds phrase queries")
+    parser.add_argument("--shards", type=int, default=1, help="also time queries over this many shards")
+    parser.add_argument("--queries", type=int, default=QUERIES)
+    parser.add_argument("--postings-cache-mb", type=float, default=POSTINGS_CACHE_MB)
+    parser.add_argument("--profile", type=str, default=None, help="folder for one .prof per stage")
+    parser.add_argument("--json", type=str, default=None, help="also write the results here")
+    parser.add_argument("--baseline", type=str, default=None, help="earlier --json output to compare with")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    args = parser.parse_args()
+    for name in ("corpus", "profile", "json", "baseline"):
+        if getattr(args, name):
+            setattr(args, name, os.path.abspath(getattr(args, name)))
+
+    result = run_benchmark(args)
+    print(json.dumps(result, indent=2))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            found = regressions(result, json.load(f), args.tolerance)
+        for line in found:
+            print(f"REGRESSION {line}")
+        sys.exit(1 if found else 0)
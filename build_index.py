@@ -2,23 +2,29 @@
     Build Index and Postings
 """
 
-from posting import Posting
-from merge import convert_pickles_to_sorted_text, merge_sorted_text_files
+from posting import add_postings, add_positional_postings
+from docstore import DocStore, DocStoreWriter, DOC_STORE_FILE, write_signatures
+from merge import (merge_segments, write_segment, write_docid_remaps, write_build_time, clear_segments,
+                   INDEX_FILE)
+from lexicon import Lexicon, LEXICON_FILE
 import tokenizer
+import simhash
 import hashlib
 import json
 import os
+import time
 from bs4 import BeautifulSoup, XMLParsedAsHTMLWarning, MarkupResemblesLocatorWarning
 import warnings
 import re
-import pickle
-import gc
-from nltk.stem import PorterStemmer
+from argparse import ArgumentParser
+from array import array
+from multiprocessing import Pool
 
-MAX_INDEX = 50000 
+INDEX_MEMORY_MB = 256 # estimated in-memory index size that triggers a spill
+SHARDS_PER_WORKER = 4 # smaller shards keep the pool busy at the end
 
 seen_hashes = set()
-unique_tokens = set()
+near_duplicates = simhash.SimHashIndex()
 file_names_sizes = {}
 
 def collect_paths(root: str): 
@@ -27,6 +33,8 @@ def collect_paths(root: str):
         for filename in files:
             full_path = os.path.abspath(os.path.join(root, filename))
             paths.append(full_path)
+    # walk order depends on the filesystem, docids should not
+    paths.sort()
     return paths
 
 def get_visible_text(html: str):
@@ -42,90 +50,180 @@ def get_visible_text(html: str):
     soup.decompose()
     return " ".join(text.split()).lower()
 
+def ignore_parser_warnings():
+    warnings.filterwarnings("ignore", category=XMLParsedAsHTMLWarning)
+    warnings.filterwarnings("ignore", category=MarkupResemblesLocatorWarning)
+
+def page_hash(text: str):
+    return hashlib.md5(text.encode()).hexdigest()
+
 def is_duplicate_page(text: str):
-    hash_val = hashlib.md5(text.encode()).hexdigest()
+    return is_duplicate_hash(page_hash(text))
+
+def is_duplicate_hash(hash_val: str):
     if hash_val in seen_hashes:
         return True
     seen_hashes.add(hash_val)
     return False
 
-def near_duplicate(text):
-    return False
+def near_duplicate(fingerprint: int):
+    """
+    True if an earlier kept page's SimHash is within MAX_DISTANCE bits,
+    otherwise remembers this page's fingerprint
+    """
+    return near_duplicates.check_and_add(fingerprint)
 
 def chunk_generator(paths, chunk_size):
     for i in range(0, len(paths), chunk_size):
         yield paths[i:i + chunk_size]
 
-def write_to_file(Index: dict, file_num: int):
-    folder_name = "index_pickle"
-    file_name = f"index_{file_num}.pickle"
-    full_path = os.path.join(folder_name, file_name)
-    if not os.path.exists(folder_name):
-        os.makedirs(folder_name)
-    with open(full_path, 'wb') as f:
-        pickle.dump(Index, f, protocol=pickle.HIGHEST_PROTOCOL)
-    file_names_sizes[file_name] = os.path.getsize(full_path) / 1024
-
-def build_index(documents: list[str]): 
+def parse_document(doc: str, positions: bool = False):
+    """
+    Parses, tokenizes and stems one json page.
+    Returns (url, page hash, token count, frequencies, simhash) or None if empty,
+    with positions the frequencies are each term's token positions instead
+    """
+    with open(doc, 'r') as d:
+        doc_content = json.load(d)
+
+    html = doc_content.get("content", "")
+    if not html:
+        return None
+
+    return parse_text(doc_content.get("url", ""), get_visible_text(html), positions)
+
+def parse_text(url: str, text: str, positions: bool = False):
+    """
+    parse_document for a page whose visible text is already extracted
+    """
+    tokens = tokenizer.tokenize(text)
+    if positions:
+        frequency = tokenizer.compute_stem_positions(tokens)
+    else:
+        frequency = tokenizer.compute_stem_frequencies(tokens)
+    fingerprint = simhash.fingerprint(simhash.shingles(tokens))
+    return url, page_hash(text), len(tokens), frequency, fingerprint
+
+def index_shard(shard_num: int, paths: list[str], memory_mb: float = INDEX_MEMORY_MB,
+                positions: bool = False):
+    """
+    Indexes one contiguous slice of the paths, can run in a worker process.
+    Docids are local to the shard, build_index maps them to global ones.
+    The in-memory index is spilled to a segment whenever its estimated size
+    reaches memory_mb, so segment count follows the budget and not the corpus.
+    With positions the segments also record every term's token positions.
+    Returns the kept documents as (hash, url, token count, simhash) in docid order,
+    the sizes of the partial indexes spilled and the shard's stem table.
+    """
     Index = {}
-    n = 0
+    budget = memory_mb * 1024 * 1024
+    estimate = 0
     file_num = 1
-    stemmer = PorterStemmer()
-    for chunk in chunk_generator(documents, 200):
-        for doc in chunk:
-            try:
-                with open(doc, 'r') as d:
-                    doc_content = json.load(d)
-                n += 1
-                
-                html = doc_content.get("content", "")
-                
-                if not html:
-                    continue
-                    
-                text = get_visible_text(html)
-                if is_duplicate_page(text) or near_duplicate(text):
-                    continue
-                url = doc_content.get("url", "")     
-                tokens = tokenizer.tokenize(text)
-                stemmed_tokens = [stemmer.stem(token) for token in tokens]
-                frequency = tokenizer.compute_word_frequencies(stemmed_tokens)
-                
-                for token_lower, freq in frequency.items():
-                    if len(token_lower) > 200: 
-                        continue           
-                    # hash the word to save on ram
-                    unique_tokens.add(hash(token_lower))          
-                    if token_lower not in Index:
-                        Index[token_lower] = [] 
-                    Index[token_lower].append(Posting(n, freq, url)) # added url attribute
-                    
-                # delete to save ram again
-                del html
-                del url
-                del text
-                del tokens
-                del stemmed_tokens
-                
-            except json.JSONDecodeError:
-                print(f"JSON file could not be read: {doc}")
-            except Exception as e:
-                print(f"Skipping file {doc} due to error: {e}")
-                
-        if Index:
-            write_to_file(Index, file_num)
+    shard_hashes = set()
+    kept = []
+    sizes = {}
+    add = add_positional_postings if positions else add_postings
+    for doc in paths:
+        try:
+            parsed = parse_document(doc, positions)
+            if parsed is None:
+                continue
+
+            url, hash_val, length, frequency, fingerprint = parsed
+            # exact duplicates inside the shard, near duplicates and
+            # duplicates across shards are dropped when docids are
+            # assigned, in path order
+            if hash_val in shard_hashes:
+                continue
+            shard_hashes.add(hash_val)
+            docid = len(kept)
+            kept.append((hash_val, url, length, fingerprint))
+            estimate += add(Index, docid, frequency)
+
+        except json.JSONDecodeError:
+            print(f"JSON file could not be read: {doc}")
+        except Exception as e:
+            print(f"Skipping file {doc} due to error: {e}")
+
+        if estimate >= budget:
+            # spilled straight to a term sorted binary segment, postings
+            # hold no cycles so refcounting frees them without a gc pass
+            segment_name = f"index_{shard_num}_{file_num}"
+            sizes[segment_name] = write_segment(Index, segment_name, positions)
             file_num += 1
-            Index.clear() 
-            
-        gc.collect() 
+            Index.clear()
+            estimate = 0
+
+    if Index:
+        segment_name = f"index_{shard_num}_{file_num}"
+        sizes[segment_name] = write_segment(Index, segment_name, positions)
+
+    print(f"Shard {shard_num}: {file_num} segments, {tokenizer.stem_cache.info()}")
+    return kept, sizes, tokenizer.stem_cache.table
+
+def build_index(documents: list[str], workers: int = 1, memory_mb: float = INDEX_MEMORY_MB,
+                positions: bool = False, collected_at: float = None): 
+    """
+    Splits the paths into contiguous shards and indexes them, in a process
+    pool when workers > 1. Duplicates are resolved and docids handed out in
+    path order afterwards, so the result is the same for any worker count.
+    memory_mb is shared by the workers, each one indexes a shard at a time.
+    positions builds a positional index for phrase and proximity queries.
+    collected_at is when the paths were collected, pages saved after it
+    are new to live_index.py.
+    """
+    if collected_at is None:
+        collected_at = time.time()
+    clear_segments()
+    if workers > 1:
+        shard_size = -(-len(documents) // (workers * SHARDS_PER_WORKER)) or 1
+    else:
+        shard_size = len(documents) or 1
+    shard_memory_mb = memory_mb / max(1, workers)
+    shards = [(shard_num, paths, shard_memory_mb, positions)
+              for shard_num, paths in enumerate(chunk_generator(documents, shard_size))]
+
+    if workers > 1:
+        with Pool(workers, initializer=ignore_parser_warnings) as pool:
+            results = pool.starmap(index_shard, shards)
+    else:
+        results = [index_shard(*shard) for shard in shards]
+
+    remaps = {}
+    signatures = []
+    with DocStoreWriter(DOC_STORE_FILE) as docs:
+        for shard_num, (kept, sizes, stem_table) in enumerate(results):
+            file_names_sizes.update(sizes)
+            tokenizer.stem_cache.update(stem_table)
+            remap = array('i')
+            for hash_val, url, length, fingerprint in kept:
+                if is_duplicate_hash(hash_val) or near_duplicate(fingerprint):
+                    remap.append(-1)
+                else:
+                    # urls live in the doc store, postings only carry the docid
+                    remap.append(docs.add(url, length))
+                    signatures.append((bytes.fromhex(hash_val), fingerprint))
+            remaps[shard_num] = remap
+    write_docid_remaps(remaps)
+    # lets live_index.py skip unchanged and duplicate pages later
+    write_signatures(signatures)
+    write_build_time(collected_at)
+    # lets the searcher stem queries with a lookup
+    tokenizer.stem_cache.save(tokenizer.STEM_TABLE_FILE)
 
 
 def write_report(filename="indexer_report.txt"):
     with open(filename, "w") as f:
-        f.write(f"Indexed documents: {len(seen_hashes)}\n\n")
-        f.write(f"Number of unique tokens: \n{len(unique_tokens)}\n\n")
+        docs = DocStore(DOC_STORE_FILE)
+        f.write(f"Indexed documents: {len(docs)}\n\n")
+        docs.close()
+        lexicon = Lexicon(LEXICON_FILE)
+        f.write(f"Number of unique tokens: \n{len(lexicon)}\n\n")
+        lexicon.close()
         f.write("Total size of index in KB:\n")
-        total_size = os.path.getsize("master_index.txt") / 1024
+        total_size = os.path.getsize(INDEX_FILE) / 1024
+        total_size += os.path.getsize(DOC_STORE_FILE) / 1024
+        total_size += os.path.getsize(LEXICON_FILE) / 1024
         for name, size in file_names_sizes.items():
             f.write(f"{name}: {(size):.2f} KB\n")
             total_size += size
@@ -133,10 +231,20 @@ def write_report(filename="indexer_report.txt"):
     print(f"Report written to {filename}")
 
 if __name__ == "__main__":
-    warnings.filterwarnings("ignore", category=XMLParsedAsHTMLWarning)
-    warnings.filterwarnings("ignore", category=MarkupResemblesLocatorWarning)
-    paths = collect_paths("/home/alvarov2/crawler_w26/DEV")
-    build_index(paths)
-    convert_pickles_to_sorted_text()
-    merge_sorted_text_files()
+    ignore_parser_warnings()
+    parser = ArgumentParser()
+    parser.add_argument("--root", type=str, default="/home/alvarov2/crawler_w26/DEV")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--memory-mb", type=float, default=INDEX_MEMORY_MB,
+                        help="in-memory index budget shared by the workers")
+    parser.add_argument("--positions", action="store_true",
+                        help="record token positions for phrase and proximity queries")
+    parser.add_argument("--shards", type=int, default=1,
+                        help="merge into this many document range shards, see coordinator.py")
+    args = parser.parse_args()
+    # before the walk, a page saved during it may be missed by it
+    collected_at = time.time()
+    paths = collect_paths(args.root)
+    build_index(paths, args.workers, args.memory_mb, args.positions, collected_at)
+    merge_segments(shards=args.shards)
     # write_report()
\ No newline at end of file
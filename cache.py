@@ -0,0 +1,59 @@
+"""
+    LRU cache bounded by an estimated memory budget
+"""
+
+import sys
+from collections import OrderedDict
+
+class LRUCache:
+    """
+    Evicts least recently used entries once the summed sizeof of the values
+    goes over budget bytes. Values bigger than the whole budget are not kept.
+    """
+    def __init__(self, budget: int, sizeof=sys.getsizeof):
+        self.budget = budget
+        self.sizeof = sizeof
+        self.used = 0
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key, value):
+        size = self.sizeof(value)
+        if size > self.budget:
+            return
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.used -= old[1]
+        while self.used + size > self.budget:
+            _, (_, evicted_size) = self.entries.popitem(last=False)
+            self.used -= evicted_size
+            self.evictions += 1
+        self.entries[key] = (value, size)
+        self.used += size
+
+    def clear(self):
+        self.entries.clear()
+        self.used = 0
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def info(self) -> str:
+        return (f"{self.hits} hits, {self.misses} misses, {self.hit_rate():.1%} hit rate, "
+                f"{len(self.entries)} entries, {self.used / 1024:.0f}/{self.budget / 1024:.0f} KB, "
+                f"{self.evictions} evictions")
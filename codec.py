@@ -0,0 +1,439 @@
+"""
+    Binary postings codec
+"""
+
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+
+BLOCK_SIZE = 128 # postings per skip block
+POSITIONS_BLOCK = 32 # documents per positions skip entry
+# the bytes of a vbyte number other than its last, counting what is left gives the number count
+CONTINUATION_BYTES = bytes(range(0x80, 0x100))
+
+def encode_vbyte(numbers) -> bytes:
+    """
+    Variable-byte encode non-negative ints, 7 bits per byte, low bits first.
+    The high bit marks that more bytes follow, so any value < 128 is stored
+    as a single byte equal to itself.
+    """
+    out = bytearray()
+    for n in numbers:
+        while n >= 0x80:
+            out.append((n & 0x7f) | 0x80)
+            n >>= 7
+        out.append(n)
+    return bytes(out)
+
+def decode_vbyte(data) -> list[int]:
+    # fast path: every value fit in one byte, so the bytes are the values
+    if data.isascii():
+        return list(data)
+
+    numbers = []
+    n = 0
+    shift = 0
+    for b in data:
+        if b & 0x80:
+            n |= (b & 0x7f) << shift
+            shift += 7
+        else:
+            numbers.append(n | (b << shift))
+            n = 0
+            shift = 0
+    return numbers
+
+def read_vbyte(data, pos: int):
+    """
+    Decode one number starting at pos, returns (number, next pos)
+    """
+    n = 0
+    shift = 0
+    while True:
+        b = data[pos]
+        pos += 1
+        n |= (b & 0x7f) << shift
+        if not b & 0x80:
+            return n, pos
+        shift += 7
+
+def gallop(values, target, lo: int = 0) -> int:
+    """
+    First index >= lo whose value is >= target (len(values) if none).
+    Probes lo, lo+1, lo+3, lo+7, ... then bisects the last step, so the
+    cost grows with the distance moved rather than the list length.
+    """
+    n = len(values)
+    step = 1
+    hi = lo
+    while hi < n and values[hi] < target:
+        lo = hi + 1
+        hi += step
+        step *= 2
+    return bisect_left(values, target, lo, min(hi, n))
+
+def encode_postings(postings) -> bytes:
+    """
+    postings is a docid sorted list of [docid, freq].
+    Layout: df | skip count | len(skips) | len(gaps) | skips | docid gaps | freqs
+
+    Lists longer than BLOCK_SIZE get one skip entry per block holding the
+    block's last docid and where the block ends in the gap and freq streams
+    (each delta coded against the previous entry), so a reader can jump to
+    the block that holds a docid and decode only that block.
+    """
+    gaps = []
+    prev = 0
+    for p in postings:
+        gaps.append(p[0] - prev)
+        prev = p[0]
+
+    if len(postings) <= BLOCK_SIZE:
+        gap_bytes = encode_vbyte(gaps)
+        freq_bytes = encode_vbyte(p[1] for p in postings)
+        skips = []
+    else:
+        gap_parts = []
+        freq_parts = []
+        skips = []
+        gap_end = freq_end = 0
+        prev_last = prev_gap_end = prev_freq_end = 0
+        for start in range(0, len(postings), BLOCK_SIZE):
+            block = postings[start:start + BLOCK_SIZE]
+            gap_parts.append(encode_vbyte(gaps[start:start + BLOCK_SIZE]))
+            freq_parts.append(encode_vbyte(p[1] for p in block))
+            gap_end += len(gap_parts[-1])
+            freq_end += len(freq_parts[-1])
+            last = block[-1][0]
+            skips.extend((last - prev_last, gap_end - prev_gap_end, freq_end - prev_freq_end))
+            prev_last, prev_gap_end, prev_freq_end = last, gap_end, freq_end
+        gap_bytes = b"".join(gap_parts)
+        freq_bytes = b"".join(freq_parts)
+
+    skip_bytes = encode_vbyte(skips)
+    header = encode_vbyte((len(postings), len(skips) // 3, len(skip_bytes), len(gap_bytes)))
+    return header + skip_bytes + gap_bytes + freq_bytes
+
+def read_header(data):
+    """
+    Returns (df, skip count, skip table start, gap stream start, freq stream start)
+    """
+    df, pos = read_vbyte(data, 0)
+    n_skips, pos = read_vbyte(data, pos)
+    skip_len, pos = read_vbyte(data, pos)
+    gap_len, pos = read_vbyte(data, pos)
+    return df, n_skips, pos, pos + skip_len, pos + skip_len + gap_len
+
+def docid_range(data) -> tuple[int, int]:
+    """
+    (first docid, last docid) of a non-empty encoded list, from its first
+    gap and its skip table, so only a short list is decoded
+    """
+    df, n_skips, skip_start, gap_start, freq_start = read_header(data)
+    first, _ = read_vbyte(data, gap_start)
+    if n_skips:
+        last = sum(decode_vbyte(data[skip_start:gap_start])[0::3])
+    else:
+        last = sum(decode_vbyte(data[gap_start:freq_start]))
+    return first, last
+
+def decode_postings_arrays(data) -> tuple[list[int], list[int]]:
+    """
+    Inverse of encode_postings as parallel (docids, freqs) lists
+    """
+    _, _, _, gap_start, freq_start = read_header(data)
+    # blocks are back to back, so the whole stream decodes in one go
+    docids = list(accumulate(decode_vbyte(data[gap_start:freq_start])))
+    freqs = decode_vbyte(data[freq_start:])
+    return docids, freqs
+
+def decode_postings(data) -> list[tuple]:
+    """
+    Inverse of encode_postings, returns (docid, freq) tuples
+    """
+    return list(zip(*decode_postings_arrays(data)))
+
+def concat_postings(parts) -> bytes:
+    """
+    Joins encoded lists whose docid ranges don't overlap, given in docid
+    order as (data, docid offset). Only each part's first gap is re-encoded
+    and the skip table is rebuilt from the parts' own skip entries, so the
+    gap and freq streams are copied without decoding them.
+    """
+    gap_parts = []
+    freq_parts = []
+    blocks = [] # (last docid, gap end, freq end) in the joined streams
+    df_total = 0
+    prev_last = None
+    gap_pos = freq_pos = 0
+    for data, offset in parts:
+        df, n_skips, skip_start, gap_start, freq_start = read_header(data)
+        if not df:
+            continue
+        first_gap, rest_start = read_vbyte(data, gap_start)
+        first = first_gap + offset
+        if prev_last is not None and first <= prev_last:
+            raise ValueError(f"postings overlap: docid {first} after {prev_last}")
+        new_first = encode_vbyte((first - (prev_last or 0),))
+        # every gap end inside this part moves by the first gap's change in width
+        shift = gap_pos + len(new_first) - (rest_start - gap_start)
+
+        if n_skips:
+            skips = decode_vbyte(data[skip_start:gap_start])
+            for last, gap_end, freq_end in zip(accumulate(skips[0::3]),
+                                               accumulate(skips[1::3]),
+                                               accumulate(skips[2::3])):
+                blocks.append((last + offset, gap_end + shift, freq_end + freq_pos))
+        else:
+            # a short list, its last docid is the sum of its gaps
+            last = sum(decode_vbyte(data[gap_start:freq_start])) + offset
+            blocks.append((last, freq_start - gap_start + shift, len(data) - freq_start + freq_pos))
+
+        gap_parts.append(new_first)
+        gap_parts.append(data[rest_start:freq_start])
+        freq_parts.append(data[freq_start:])
+        gap_pos = blocks[-1][1]
+        freq_pos = blocks[-1][2]
+        prev_last = blocks[-1][0]
+        df_total += df
+
+    skips = []
+    if df_total > BLOCK_SIZE:
+        # parts can be short, drop boundaries until blocks hold about
+        # BLOCK_SIZE bytes of gaps
+        prev_last = prev_gap_end = prev_freq_end = 0
+        for i, (last, gap_end, freq_end) in enumerate(blocks):
+            if gap_end - prev_gap_end < BLOCK_SIZE and i < len(blocks) - 1:
+                continue
+            skips.extend((last - prev_last, gap_end - prev_gap_end, freq_end - prev_freq_end))
+            prev_last, prev_gap_end, prev_freq_end = last, gap_end, freq_end
+
+    skip_bytes = encode_vbyte(skips)
+    gap_bytes = b"".join(gap_parts)
+    header = encode_vbyte((df_total, len(skips) // 3, len(skip_bytes), len(gap_bytes)))
+    return header + skip_bytes + gap_bytes + b"".join(freq_parts)
+
+def encode_doc_positions(positions) -> bytes:
+    """
+    One document's ascending token positions, gap coded
+    """
+    prev = 0
+    gaps = []
+    for p in positions:
+        gaps.append(p - prev)
+        prev = p
+    return encode_vbyte(gaps)
+
+def encode_positions(docs) -> bytes:
+    """
+    docs is one term's encode_doc_positions output per posting, in docid order.
+    Layout: doc count | skip count | len(skips) | skips | (len(doc) | doc) per posting
+
+    Every POSITIONS_BLOCK documents a skip entry records the document's
+    posting rank and where it starts in the body (both delta coded), so a
+    reader hops over at most a block of length prefixes to find one document.
+    """
+    body = bytearray()
+    skips = []
+    prev_rank = prev_offset = 0
+    for rank, doc in enumerate(docs):
+        if rank and rank % POSITIONS_BLOCK == 0:
+            skips.extend((rank - prev_rank, len(body) - prev_offset))
+            prev_rank, prev_offset = rank, len(body)
+        body += encode_vbyte((len(doc),))
+        body += doc
+    skip_bytes = encode_vbyte(skips)
+    return encode_vbyte((len(docs), len(skips) // 2, len(skip_bytes))) + skip_bytes + bytes(body)
+
+def read_positions_header(data, start: int = 0):
+    """
+    Returns (doc count, skip ranks, skip body offsets, body start) for the
+    record at start, the skip lists start with the implicit entry for rank 0
+    """
+    n_docs, pos = read_vbyte(data, start)
+    n_skips, pos = read_vbyte(data, pos)
+    skip_len, pos = read_vbyte(data, pos)
+    skips = decode_vbyte(data[pos:pos + skip_len]) if n_skips else []
+    ranks = [0] + list(accumulate(skips[0::2]))
+    offsets = [0] + list(accumulate(skips[1::2]))
+    return n_docs, ranks, offsets, pos + skip_len
+
+def split_positions(data) -> list[bytes]:
+    """
+    Inverse of encode_positions, each document's still encoded positions
+    """
+    n_docs, _, _, pos = read_positions_header(data)
+    docs = []
+    for _ in range(n_docs):
+        n, pos = read_vbyte(data, pos)
+        docs.append(bytes(data[pos:pos + n]))
+        pos += n
+    return docs
+
+def concat_positions(parts) -> bytes:
+    """
+    Joins positions records in docid order, the same order concat_postings
+    joins their postings. Bodies are copied as they are and the skip table
+    is rebuilt from the parts' entries, one entry per part start included.
+    """
+    bodies = []
+    entries = [] # (rank, body offset) in the joined record
+    n_total = 0
+    body_pos = 0
+    for data in parts:
+        n_docs, ranks, offsets, body_start = read_positions_header(data)
+        if not n_docs:
+            continue
+        entries.extend((rank + n_total, offset + body_pos) for rank, offset in zip(ranks, offsets))
+        bodies.append(data[body_start:])
+        n_total += n_docs
+        body_pos += len(bodies[-1])
+
+    skips = []
+    prev_rank = prev_offset = 0
+    for rank, offset in entries:
+        # short parts would leave entries a few documents apart
+        if rank - prev_rank < POSITIONS_BLOCK:
+            continue
+        skips.extend((rank - prev_rank, offset - prev_offset))
+        prev_rank, prev_offset = rank, offset
+    skip_bytes = encode_vbyte(skips)
+    return encode_vbyte((n_total, len(skips) // 2, len(skip_bytes))) + skip_bytes + b"".join(bodies)
+
+class PositionsReader:
+    """
+    Random access to one term's positions by posting rank, only the
+    requested documents are decoded. The record starts at start in data,
+    so it can be read in place from the positions mmap. Lookups in rank
+    order, as an intersection makes them, carry on from the last document
+    instead of the skip entry when that is closer.
+    """
+    def __init__(self, data, start: int = 0):
+        self.data = data
+        self.df, self.ranks, self.offsets, self.body_start = read_positions_header(data, start)
+        self.next_rank = 0
+        self.next_pos = self.body_start
+
+    def positions(self, rank: int) -> list[int]:
+        if not 0 <= rank < self.df:
+            raise IndexError(f"posting rank {rank} out of range")
+        i = bisect_right(self.ranks, rank) - 1
+        if self.ranks[i] <= self.next_rank <= rank:
+            skipped, pos = self.next_rank, self.next_pos
+        else:
+            skipped, pos = self.ranks[i], self.body_start + self.offsets[i]
+        data = self.data
+        for _ in range(rank - skipped):
+            n, pos = read_vbyte(data, pos)
+            pos += n
+        n, pos = read_vbyte(data, pos)
+        self.next_rank = rank + 1
+        self.next_pos = pos + n
+        return list(accumulate(decode_vbyte(data[pos:pos + n])))
+
+class PostingsList:
+    """
+    Forward only cursor over one encoded postings list. next_geq gallops over
+    the skip table to the block that can hold the target and decodes just
+    that block. Lists without skips are a single block decoded on first use.
+    docid is the current docid, None once the list is exhausted.
+    rank() is the current posting's index in the list, for positions lookups.
+    """
+    def __init__(self, data):
+        self.data = data
+        self.df, n_skips, skip_start, self.gap_start, self.freq_start = read_header(data)
+        if n_skips:
+            skips = decode_vbyte(data[skip_start:self.gap_start])
+            self.lasts = list(accumulate(skips[0::3]))
+            self.gap_ends = list(accumulate(skips[1::3]))
+            self.freq_ends = list(accumulate(skips[2::3]))
+        else:
+            self.lasts = [float('inf')]
+            self.gap_ends = [self.freq_start - self.gap_start]
+            self.freq_ends = [len(data) - self.freq_start]
+        self.block = -1
+        self.block_docids = []
+        self.block_freqs = []
+        self.block_rank = 0
+        self.pos = 0
+        self.docid = None
+        self._load(0)
+
+    @classmethod
+    def from_arrays(cls, docids, freqs):
+        """
+        Cursor over already decoded postings, e.g. from the searcher's cache
+        """
+        self = cls.__new__(cls)
+        self.data = None
+        self.df = len(docids)
+        self.lasts = [float('inf')]
+        self.block = 0
+        self.block_docids = docids
+        self.block_freqs = freqs
+        self.block_rank = 0
+        self.pos = 0
+        self.docid = docids[0] if docids else None
+        return self
+
+    def __len__(self):
+        return self.df
+
+    def _load(self, b: int):
+        if b >= len(self.lasts) or not self.df:
+            self.block = len(self.lasts)
+            self.docid = None
+            return
+        gap_lo = self.gap_ends[b - 1] if b else 0
+        freq_lo = self.freq_ends[b - 1] if b else 0
+        base = self.lasts[b - 1] if b else 0
+        gaps = decode_vbyte(self.data[self.gap_start + gap_lo:self.gap_start + self.gap_ends[b]])
+        gaps[0] += base
+        self.block_docids = list(accumulate(gaps))
+        self.block_freqs = decode_vbyte(self.data[self.freq_start + freq_lo:self.freq_start + self.freq_ends[b]])
+        self.block_rank = None
+        self.block = b
+        self.pos = 0
+        self.docid = self.block_docids[0]
+
+    def advance(self):
+        """
+        Moves to the next posting, returns its docid or None
+        """
+        if self.docid is None:
+            return None
+        self.pos += 1
+        if self.pos < len(self.block_docids):
+            self.docid = self.block_docids[self.pos]
+        else:
+            self._load(self.block + 1)
+        return self.docid
+
+    def next_geq(self, target: int):
+        """
+        Moves to the first posting with docid >= target, returns it or None
+        """
+        if self.docid is None or self.docid >= target:
+            return self.docid
+        if self.lasts[self.block] < target:
+            b = gallop(self.lasts, target, self.block + 1)
+            self._load(b)
+            if self.docid is None or self.docid >= target:
+                return self.docid
+        i = gallop(self.block_docids, target, self.pos)
+        if i == len(self.block_docids):
+            self._load(self.block + 1)
+            return self.docid
+        self.pos = i
+        self.docid = self.block_docids[i]
+        return self.docid
+
+    def freq(self) -> int:
+        return self.block_freqs[self.pos]
+
+    def rank(self) -> int:
+        if self.block_rank is None:
+            # one freq per posting before this block, each ends in one non-continuation byte
+            freq_lo = self.freq_ends[self.block - 1] if self.block else 0
+            before = self.data[self.freq_start:self.freq_start + freq_lo]
+            self.block_rank = len(before.translate(None, CONTINUATION_BYTES))
+        return self.block_rank + self.pos
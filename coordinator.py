@@ -0,0 +1,124 @@
+"""
+    Query coordinator for a sharded index: one searcher process per shard,
+    every query fans out to all of them and their results are merged
+"""
+
+import heapq
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+import tokenizer
+from docstore import DocStore, DOC_STORE_FILE
+from lexicon import Lexicon
+from merge import shard_paths, count_shards, SHARD_DIR
+from search import Searcher, parse_query, RESULTS_TO_PRINT, POSTINGS_CACHE_MB, RESULT_CACHE_MB
+
+# the searcher for the shard this process serves
+shard_searcher = None
+
+def open_shard(postings_path: str, lexicon_path: str, doc_store_path: str,
+               postings_cache_mb: float, result_cache_mb: float):
+    global shard_searcher
+    shard_searcher = Searcher(postings_path, doc_store_path, lexicon_path,
+                              postings_cache_mb, result_cache_mb)
+
+def shard_ready() -> int:
+    return len(shard_searcher.lexicon)
+
+def shard_rank(query: str, k: int, dfs: dict):
+    return shard_searcher.rank(query, k, dfs)
+
+def shard_search(query: str):
+    return shard_searcher.search(query)
+
+class ShardedSearcher:
+    """
+    rank and search of Searcher over the shards merge_shards wrote. Shards
+    hold disjoint docid ranges in order, so AND results concatenate and the
+    shards' top k lists merge into the global top k. Document frequencies
+    are summed over the shard lexicons here and sent with each ranked query,
+    and all shards read the one doc store, so a shard scores a document
+    exactly as the unsharded index would. Cache budgets are per shard.
+    """
+    def __init__(self, shard_dir=SHARD_DIR, doc_store_path=DOC_STORE_FILE,
+                 postings_cache_mb=POSTINGS_CACHE_MB, result_cache_mb=RESULT_CACHE_MB):
+        shards = count_shards(shard_dir)
+        if not shards:
+            raise ValueError(f"no shards in {shard_dir}, merge with merge.py --shards N")
+        self.lexicons = [Lexicon(shard_paths(shard, shard_dir)[1]) for shard in range(shards)]
+        self.positional = all(lexicon.positional for lexicon in self.lexicons)
+        self.docs = DocStore(doc_store_path)
+        tokenizer.stem_cache.load(tokenizer.STEM_TABLE_FILE)
+
+        # one process per shard keeps that shard's mmaps and caches warm
+        self.pools = [ProcessPoolExecutor(1, initializer=open_shard,
+                                          initargs=(*shard_paths(shard, shard_dir), doc_store_path,
+                                                    postings_cache_mb, result_cache_mb))
+                      for shard in range(shards)]
+        # processes start on first use, start them now so a bad shard fails here
+        for future in [pool.submit(shard_ready) for pool in self.pools]:
+            future.result()
+
+    def __len__(self):
+        return len(self.pools)
+
+    def document_frequencies(self, terms) -> dict:
+        dfs = {}
+        for term in terms:
+            df = 0
+            for lexicon in self.lexicons:
+                entry = lexicon.lookup(term)
+                if entry is not None:
+                    df += entry[2]
+            if df:
+                dfs[term] = df
+        return dfs
+
+    def rank(self, query: str, k: int = RESULTS_TO_PRINT):
+        """
+        Global BM25 top k as (docid, score), best first and ties in docid
+        order like Searcher.rank
+        """
+        terms, phrases = parse_query(query)
+        dfs = self.document_frequencies(set(terms).union(*(phrase for phrase, _ in phrases)))
+        futures = [pool.submit(shard_rank, query, k, dfs) for pool in self.pools]
+        results = [future.result() for future in futures]
+        return list(islice(heapq.merge(*results, key=lambda r: (-r[1], r[0])), k))
+
+    def search(self, query: str):
+        """
+        AND (and phrase) matches as (docid, freq) in docid order
+        """
+        futures = [pool.submit(shard_search, query) for pool in self.pools]
+        return [result for future in futures for result in future.result()]
+
+    def get_url(self, docid):
+        return self.docs.url(docid)
+
+    def close(self):
+        for pool in self.pools:
+            pool.shutdown()
+        for lexicon in self.lexicons:
+            lexicon.close()
+        self.docs.close()
+
+if __name__ == "__main__":
+    searcher = ShardedSearcher()
+    print(f"Serving {len(searcher)} shards")
+
+    while True:
+        query = input("\nEnter search query (or 'q' to quit): ").strip()
+        if query.lower() == 'q':
+            searcher.close()
+            break
+
+        try:
+            results = searcher.rank(query, RESULTS_TO_PRINT)
+        except ValueError as e:
+            print(e)
+            continue
+
+        if not results:
+            print("No documents found.")
+        else:
+            for docid, score in results:
+                print(f"DocID: {docid} // Score {score:.3f} // URL: {searcher.get_url(docid)}")
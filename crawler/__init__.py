@@ -1,4 +1,5 @@
 from utils import get_logger
+from utils.metrics import StatsLogger, serve_metrics
 from crawler.frontier import Frontier
 from crawler.worker import Worker
 
@@ -9,8 +10,18 @@ class Crawler(object):
         self.frontier = frontier_factory(config, restart)
         self.workers = list()
         self.worker_factory = worker_factory
+        self.stats_logger = None
+        self.metrics_server = None
 
     def start_async(self):
+        interval = getattr(self.config, "stats_interval", 0)
+        if interval > 0:
+            self.stats_logger = StatsLogger(self.logger, interval)
+            self.stats_logger.start()
+        port = getattr(self.config, "metrics_port", 0)
+        if port:
+            self.metrics_server = serve_metrics(port)
+            self.logger.info(f"Metrics at http://127.0.0.1:{port}/metrics")
         self.workers = [
             self.worker_factory(worker_id, self.config, self.frontier)
             for worker_id in range(self.config.threads_count)]
@@ -20,7 +31,15 @@ class Crawler(object):
     def start(self):
         self.start_async()
         self.join()
+        if hasattr(self.frontier, "close"):
+            self.frontier.close()
 
     def join(self):
         for worker in self.workers:
             worker.join()
+        if self.stats_logger is not None:
+            self.stats_logger.stop()
+            self.stats_logger = None
+        if self.metrics_server is not None:
+            self.metrics_server.shutdown()
+            self.metrics_server = None
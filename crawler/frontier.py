@@ -1,18 +1,36 @@
 import os
-import shelve
+import time
+import heapq
+import asyncio
 
-from threading import Thread, RLock
+from threading import Thread, RLock, Condition
 from queue import Queue, Empty
+from collections import deque
+from urllib.parse import urlparse
 
 from utils import get_logger, get_urlhash, normalize
 from scraper import is_valid
+from crawler.store import FrontierStore, delete_store
+from crawler.seen import SeenUrls
 
 class Frontier(object):
+    '''
+    Thread safe frontier with one queue per host. Hosts with queued urls sit
+    in a heap keyed by the time they may next be fetched, and a host is taken
+    out of the heap while one of its urls is being downloaded, so every host
+    gets its politeness delay while workers fetch from different hosts.
+    '''
     def __init__(self, config, restart):
         self.logger = get_logger("FRONTIER")
         self.config = config
-        self.to_be_downloaded = list()
-        
+        self.lock = RLock()
+        self.ready = Condition(self.lock)
+        self.host_queues = dict()   # host -> deque of urls to be downloaded
+        self.host_ready_at = dict() # host -> earliest time of its next fetch
+        self.ready_hosts = list()   # heap of (ready time, host)
+        self.active_hosts = set()   # hosts in the heap or being downloaded
+        self.in_flight = 0
+
         if not os.path.exists(self.config.save_file) and not restart:
             # Save file does not exist, but request to load save.
             self.logger.info(
@@ -22,9 +40,12 @@ class Frontier(object):
             # Save file does exists, but request to start from seed.
             self.logger.info(
                 f"Found save file {self.config.save_file}, deleting it.")
-            os.remove(self.config.save_file)
+            delete_store(self.config.save_file)
         # Load existing save file, or create one if it does not exist.
-        self.save = shelve.open(self.config.save_file)
+        # Writes are committed in batches, see FrontierStore.
+        self.save = FrontierStore(self.config.save_file)
+        # dedup checks hit memory, the store only confirms probable hits
+        self.seen = SeenUrls(self.save)
         if restart:
             for url in self.config.seed_urls:
                 self.add_url(url)
@@ -39,34 +60,152 @@ class Frontier(object):
         ''' This function can be overridden for alternate saving techniques. '''
         total_count = len(self.save)
         tbd_count = 0
-        for url, completed in self.save.values():
-            if not completed and is_valid(url):
-                self.to_be_downloaded.append(url)
-                tbd_count += 1
+        with self.lock:
+            for url, completed in self.save.values():
+                if not completed and is_valid(url):
+                    self._enqueue(url)
+                    tbd_count += 1
         self.logger.info(
             f"Found {tbd_count} urls to be downloaded from {total_count} "
             f"total urls discovered.")
 
+    @staticmethod
+    def _host(url):
+        return urlparse(url).netloc.lower()
+
+    def _enqueue(self, url):
+        # caller holds the lock
+        host = self._host(url)
+        self.host_queues.setdefault(host, deque()).append(url)
+        if host not in self.active_hosts:
+            self.active_hosts.add(host)
+            heapq.heappush(self.ready_hosts, (self.host_ready_at.get(host, 0), host))
+            self.ready.notify()
+
+    def _finished(self):
+        # caller holds the lock
+        return not self.ready_hosts and not self.in_flight
+
+    def _pop_ready(self):
+        '''
+        Caller holds the lock. Returns (url, 0) when a host is ready, else
+        (None, seconds until the next host is), or (None, None) when only
+        downloads in flight can queue more urls.
+        '''
+        if not self.ready_hosts:
+            return None, None
+        ready_at, host = self.ready_hosts[0]
+        wait = ready_at - time.monotonic()
+        if wait > 0:
+            return None, wait
+        heapq.heappop(self.ready_hosts)
+        queue = self.host_queues[host]
+        url = queue.pop()
+        if not queue:
+            del self.host_queues[host]
+        self.in_flight += 1
+        return url, 0
+
     def get_tbd_url(self):
-        try:
-            return self.to_be_downloaded.pop()
-        except IndexError:
-            return None
+        '''
+        Blocks until some host's politeness delay has passed and returns one
+        of its urls. Returns None once nothing is queued or being downloaded.
+        '''
+        with self.ready:
+            while True:
+                if self._finished():
+                    # wake the other workers so they can stop too
+                    self.ready.notify_all()
+                    return None
+                url, wait = self._pop_ready()
+                if url:
+                    return url
+                self.ready.wait(wait)
 
     def add_url(self, url):
         url = normalize(url)
         urlhash = get_urlhash(url)
-        if urlhash not in self.save:
-            self.save[urlhash] = (url, False)
-            self.save.sync()
-            self.to_be_downloaded.append(url)
-    
+        with self.lock:
+            if urlhash not in self.seen:
+                self.seen.add(urlhash)
+                self.save[urlhash] = (url, False)
+                self._enqueue(url)
+
     def mark_url_complete(self, url):
         urlhash = get_urlhash(url)
-        if urlhash not in self.save:
-            # This should not happen.
-            self.logger.error(
-                f"Completed url {url}, but have not seen it before.")
+        with self.lock:
+            if urlhash not in self.seen:
+                # This should not happen.
+                self.logger.error(
+                    f"Completed url {url}, but have not seen it before.")
+
+            self.save[urlhash] = (url, True)
+
+            # the host becomes fetchable again after the politeness delay
+            host = self._host(url)
+            self.in_flight -= 1
+            self.host_ready_at[host] = time.monotonic() + self.config.time_delay
+            if host in self.host_queues:
+                heapq.heappush(self.ready_hosts, (self.host_ready_at[host], host))
+            else:
+                self.active_hosts.discard(host)
+            self.ready.notify_all()
+
+    def close(self):
+        # commits the last batch of url state
+        with self.lock:
+            self.save.close()
+
+class AsyncFrontier(Frontier):
+    '''
+    Frontier for AsyncWorker. Same per-host queues and politeness, but an
+    event loop waits on an asyncio.Event instead of the Condition. Urls may
+    be added from any thread, the waiting loops are woken thread safely.
+    '''
+    def __init__(self, config, restart):
+        self.waiters = list()  # (loop, asyncio.Event) of the worker loops
+        super().__init__(config, restart)
+
+    def subscribe(self, loop):
+        changed = asyncio.Event()
+        with self.lock:
+            self.waiters.append((loop, changed))
+        return changed
+
+    def unsubscribe(self, changed):
+        with self.lock:
+            self.waiters = [w for w in self.waiters if w[1] is not changed]
+
+    def _wake(self):
+        for loop, changed in self.waiters:
+            if not changed.is_set():
+                loop.call_soon_threadsafe(changed.set)
+
+    def _enqueue(self, url):
+        super()._enqueue(url)
+        self._wake()
+
+    def mark_url_complete(self, url):
+        super().mark_url_complete(url)
+        with self.lock:
+            self._wake()
 
-        self.save[urlhash] = (url, True)
-        self.save.sync()
+    async def get_tbd_url_async(self, changed):
+        '''
+        Awaits a url whose host is past its politeness delay, None once
+        nothing is queued or being downloaded. changed is from subscribe.
+        '''
+        while True:
+            with self.lock:
+                if self._finished():
+                    self._wake()
+                    return None
+                url, wait = self._pop_ready()
+                if url:
+                    return url
+                # cleared under the lock, so a later change sets it again
+                changed.clear()
+            try:
+                await asyncio.wait_for(changed.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
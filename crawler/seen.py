@@ -0,0 +1,121 @@
+import math
+
+from array import array
+from bisect import bisect_left
+from itertools import chain
+from threading import RLock, Thread
+
+MIN_CAPACITY = 1_000_000  # urls the bloom filter is sized for at least
+FALSE_POSITIVE_RATE = 0.01
+MERGE_AT = 50_000         # recent hashes kept in a set before merging
+GROW_AT = 0.5             # share of bloom capacity that starts building a bigger one
+SWAP_AT = 1_000           # urls added during a grow that are left for the swap
+
+class BloomFilter(object):
+    '''
+    Bit array with k probes from double hashing a 64 bit key, which is
+    already a uniform hash (a sha256 prefix).
+    '''
+    def __init__(self, capacity, error_rate=FALSE_POSITIVE_RATE):
+        self.capacity = capacity
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.probes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        h1 = key & 0xffffffff
+        h2 = (key >> 32) | 1
+        size = self.size
+        return [(h1 + i * h2) % size for i in range(self.probes)]
+
+    def add(self, key):
+        bits = self.bits
+        for pos in self._positions(key):
+            bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, key):
+        bits = self.bits
+        for pos in self._positions(key):
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+class SeenUrls(object):
+    '''
+    In-memory set of discovered url hashes in front of the frontier store.
+    A Bloom filter answers most new urls, then the 64 bit hash prefixes,
+    kept as a sorted array('Q') plus a small set of recent ones, and only a
+    prefix hit is confirmed against the store. Costs about 9 bytes per url
+    and is rebuilt from the store's hashes at startup.
+    '''
+    def __init__(self, store):
+        self.store = store
+        self.lock = RLock()
+        prefixes = sorted(self._prefix(key) for key in store.hashes())
+        self.sorted = array('Q', prefixes)
+        self.recent = set()
+        self.bloom = BloomFilter(max(MIN_CAPACITY, 2 * len(prefixes)))
+        # prefixes added while a bigger filter is built, None when not growing
+        self.grown = None
+        for prefix in self.sorted:
+            self.bloom.add(prefix)
+
+    @staticmethod
+    def _prefix(key):
+        return int.from_bytes(key[:8], "big")
+
+    def __len__(self):
+        return len(self.sorted) + len(self.recent)
+
+    def _has_prefix(self, prefix):
+        if prefix in self.recent:
+            return True
+        i = bisect_left(self.sorted, prefix)
+        return i < len(self.sorted) and self.sorted[i] == prefix
+
+    def __contains__(self, urlhash):
+        prefix = self._prefix(bytes.fromhex(urlhash))
+        with self.lock:
+            if prefix not in self.bloom or not self._has_prefix(prefix):
+                return False
+        # a prefix match is almost surely the url, the store makes it certain
+        return urlhash in self.store
+
+    def add(self, urlhash):
+        prefix = self._prefix(bytes.fromhex(urlhash))
+        with self.lock:
+            if self._has_prefix(prefix):
+                return
+            self.recent.add(prefix)
+            self.bloom.add(prefix)
+            if self.grown is not None:
+                self.grown.append(prefix)
+            if len(self.recent) >= MERGE_AT:
+                self._merge()
+
+    def _merge(self):
+        self.sorted = array('Q', sorted(chain(self.sorted, self.recent)))
+        self.recent.clear()
+        if self.grown is None and len(self.sorted) > GROW_AT * self.bloom.capacity:
+            # past capacity the false positive rate climbs, so a bigger filter
+            # is built before then. Filling one takes seconds and add runs
+            # under the frontier lock, so it is filled in another thread.
+            self.grown = []
+            Thread(target=self._grow, args=(self.sorted,), daemon=True).start()
+
+    def _grow(self, prefixes):
+        bloom = BloomFilter(4 * len(prefixes))
+        for prefix in prefixes:
+            bloom.add(prefix)
+        while True:
+            with self.lock:
+                added = self.grown
+                if len(added) <= SWAP_AT:
+                    for prefix in added:
+                        bloom.add(prefix)
+                    self.bloom = bloom
+                    self.grown = None
+                    return
+                self.grown = []
+            for prefix in added:
+                bloom.add(prefix)
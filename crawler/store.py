@@ -0,0 +1,112 @@
+import os
+import time
+import sqlite3
+
+from threading import RLock
+
+FLUSH_EVERY = 500     # buffered writes that trigger a commit
+FLUSH_INTERVAL = 2.0  # seconds before buffered writes are committed anyway
+
+def delete_store(path):
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+class FrontierStore(object):
+    '''
+    SQLite backed replacement for the frontier shelve, with the same
+    urlhash -> (url, completed) mapping interface.
+
+    Writes go to an in-memory buffer in the order they are made and are
+    committed in one transaction every FLUSH_EVERY writes or FLUSH_INTERVAL
+    seconds (group commit), so the fsync cost is per batch and not per url.
+    Because a batch is atomic and batches keep order, a url marked complete
+    on disk always has the links scraped from it on disk too. A crash loses
+    at most the last batch, whose urls are downloaded again on resume.
+    '''
+    def __init__(self, path, flush_every=FLUSH_EVERY, flush_interval=FLUSH_INTERVAL):
+        self.path = path
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.lock = RLock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=FULL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS urls ("
+            "hash BLOB PRIMARY KEY, url TEXT NOT NULL, completed INTEGER NOT NULL"
+            ") WITHOUT ROWID")
+        self.db.commit()
+        self.pending = dict()  # urlhash -> (url, completed), not yet committed
+        self.last_flush = time.monotonic()
+
+    @staticmethod
+    def _key(urlhash):
+        # 32 raw bytes instead of 64 hex characters
+        return bytes.fromhex(urlhash)
+
+    def __contains__(self, urlhash):
+        with self.lock:
+            if urlhash in self.pending:
+                return True
+            row = self.db.execute(
+                "SELECT 1 FROM urls WHERE hash = ?", (self._key(urlhash),)).fetchone()
+            return row is not None
+
+    def __getitem__(self, urlhash):
+        with self.lock:
+            if urlhash in self.pending:
+                return self.pending[urlhash]
+            row = self.db.execute(
+                "SELECT url, completed FROM urls WHERE hash = ?",
+                (self._key(urlhash),)).fetchone()
+            if row is None:
+                raise KeyError(urlhash)
+            return row[0], bool(row[1])
+
+    def __setitem__(self, urlhash, value):
+        with self.lock:
+            # a batch is one transaction, so only the latest value matters
+            self.pending[urlhash] = value
+            if (len(self.pending) >= self.flush_every
+                    or time.monotonic() - self.last_flush >= self.flush_interval):
+                self.flush()
+
+    def __len__(self):
+        with self.lock:
+            self.flush()
+            return self.db.execute("SELECT COUNT(*) FROM urls").fetchone()[0]
+
+    def values(self):
+        with self.lock:
+            self.flush()
+            rows = self.db.execute("SELECT url, completed FROM urls").fetchall()
+        for url, completed in rows:
+            yield url, bool(completed)
+
+    def hashes(self):
+        ''' Raw 32 byte url hashes, used to rebuild the in-memory seen set. '''
+        with self.lock:
+            self.flush()
+            rows = self.db.execute("SELECT hash FROM urls").fetchall()
+        for (key,) in rows:
+            yield key
+
+    def flush(self):
+        with self.lock:
+            if self.pending:
+                with self.db:
+                    self.db.executemany(
+                        "INSERT OR REPLACE INTO urls (hash, url, completed) VALUES (?, ?, ?)",
+                        [(self._key(urlhash), url, int(completed))
+                         for urlhash, (url, completed) in self.pending.items()])
+                self.pending.clear()
+            self.last_flush = time.monotonic()
+
+    # shelve compatibility
+    sync = flush
+
+    def close(self):
+        with self.lock:
+            self.flush()
+            self.db.close()
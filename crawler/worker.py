@@ -1,10 +1,13 @@
+import time
+import asyncio
 from threading import Thread
+from concurrent.futures import ThreadPoolExecutor
 
 from inspect import getsource
-from utils.download import download
+from utils.download import download, to_response, AsyncCacheClient
 from utils import get_logger
+from utils.metrics import metrics
 import scraper
-import time
 
 
 class Worker(Thread):
@@ -19,16 +22,101 @@ class Worker(Thread):
         
     def run(self):
         while True:
-            tbd_url = self.frontier.get_tbd_url()
+            # blocked on politeness or on other workers to queue urls
+            with metrics.timer("wait"):
+                tbd_url = self.frontier.get_tbd_url()
             if not tbd_url:
                 self.logger.info("Frontier is empty. Stopping Crawler.")
                 break
-            resp = download(tbd_url, self.config, self.logger)
+            try:
+                with metrics.timer("download"):
+                    resp = download(tbd_url, self.config, self.logger)
+                self.logger.info(
+                    f"Downloaded {tbd_url}, status <{resp.status}>, "
+                    f"in {resp.fetch_time:.3f}s ({resp.attempts} tries), "
+                    f"using cache {self.config.cache_server}.")
+                scraped_urls = scraper.scraper(tbd_url, resp)
+                with metrics.timer("frontier_add"):
+                    for scraped_url in scraped_urls:
+                        self.frontier.add_url(scraped_url)
+                metrics.count("pages")
+                metrics.count("links", len(scraped_urls))
+            except Exception as e:
+                metrics.count("errors")
+                self.logger.error(f"Failed to process {tbd_url}: {e}")
+            finally:
+                # the frontier holds the host until this, then applies the
+                # politeness delay, so there is no sleep here
+                with metrics.timer("frontier_complete"):
+                    self.frontier.mark_url_complete(tbd_url)
+
+
+class AsyncWorker(Worker):
+    '''
+    Runs an event loop that keeps up to config.async_fetches downloads in
+    flight, for use with AsyncFrontier. Decoding and scraping a page is CPU
+    work, it runs in a pool of config.parser_threads threads so the loop
+    keeps fetching. Threads and not processes, scraper keeps its report
+    counters in module globals.
+    '''
+    def run(self):
+        asyncio.run(self.crawl())
+
+    async def crawl(self):
+        loop = asyncio.get_running_loop()
+        client = AsyncCacheClient(self.config, self.config.async_fetches)
+        parsers = ThreadPoolExecutor(self.config.parser_threads)
+        changed = self.frontier.subscribe(loop)
+        slots = asyncio.Semaphore(self.config.async_fetches)
+        tasks = set()
+        try:
+            while True:
+                await slots.acquire()
+                start = time.perf_counter()
+                tbd_url = await self.frontier.get_tbd_url_async(changed)
+                metrics.observe("wait", time.perf_counter() - start)
+                if not tbd_url:
+                    self.logger.info("Frontier is empty. Stopping Crawler.")
+                    break
+                task = loop.create_task(self.process(tbd_url, client, parsers, slots))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            await asyncio.gather(*tasks)
+        finally:
+            self.frontier.unsubscribe(changed)
+            await client.close()
+            parsers.shutdown()
+
+    async def process(self, tbd_url, client, parsers, slots):
+        loop = asyncio.get_running_loop()
+        try:
+            start = time.perf_counter()
+            status, content, attempts = await client.get(tbd_url, self.logger)
+            fetch_time = time.perf_counter() - start
+            metrics.observe("download", fetch_time)
+            resp = await loop.run_in_executor(
+                parsers, self.scrape, tbd_url, status, content, attempts, fetch_time)
+            metrics.count("pages")
             self.logger.info(
                 f"Downloaded {tbd_url}, status <{resp.status}>, "
+                f"in {resp.fetch_time:.3f}s ({resp.attempts} tries), "
                 f"using cache {self.config.cache_server}.")
-            scraped_urls = scraper.scraper(tbd_url, resp)
+        except Exception as e:
+            metrics.count("errors")
+            self.logger.error(f"Failed to process {tbd_url}: {e}")
+        finally:
+            with metrics.timer("frontier_complete"):
+                self.frontier.mark_url_complete(tbd_url)
+            slots.release()
+
+    def scrape(self, tbd_url, status, content, attempts, fetch_time):
+        # parser thread, the frontier is thread safe and wakes the loop
+        resp = to_response(tbd_url, status, content, self.logger)
+        resp.attempts = attempts
+        resp.fetch_time = fetch_time
+        scraped_urls = scraper.scraper(tbd_url, resp)
+        with metrics.timer("frontier_add"):
             for scraped_url in scraped_urls:
                 self.frontier.add_url(scraped_url)
-            self.frontier.mark_url_complete(tbd_url)
-            time.sleep(self.config.time_delay)
+        metrics.count("links", len(scraped_urls))
+        return resp
@@ -0,0 +1,133 @@
+"""
+    Document Store: docid -> url and per document metadata
+"""
+
+import os
+import mmap
+import struct
+
+DOC_STORE_FILE = "doc_store.bin"
+SIGNATURE_FILE = "doc_signatures.bin"
+
+# fixed width table entry: url offset into the heap, document length in tokens
+ENTRY = struct.Struct("<QI")
+# footer: table offset, document count, total tokens, shortest document, magic
+FOOTER = struct.Struct("<QIQI4s")
+MAGIC = b"DOCS"
+# per docid: md5 of the visible text, SimHash fingerprint, for incremental dedup
+SIGNATURE = struct.Struct("<16sQ")
+
+class DocStoreWriter:
+    """
+    Streams urls to disk as documents are indexed, the offset table is
+    written once at close. Docids are handed out densely from 0.
+    """
+    def __init__(self, path=DOC_STORE_FILE):
+        self.path = path
+        self.file = open(path, 'wb')
+        self.offsets = [0]
+        self.lengths = []
+        self.total_length = 0
+        self.min_length = None
+
+    def add(self, url: str, length: int) -> int:
+        url_bytes = url.encode('utf-8')
+        self.file.write(url_bytes)
+        docid = len(self.lengths)
+        self.offsets.append(self.offsets[-1] + len(url_bytes))
+        self.lengths.append(length)
+        self.total_length += length
+        if self.min_length is None or length < self.min_length:
+            self.min_length = length
+        return docid
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def close(self):
+        if self.file.closed:
+            return
+        table_offset = self.offsets[-1]
+        # one extra entry so every url's end is the next entry's offset
+        for offset, length in zip(self.offsets, self.lengths + [0]):
+            self.file.write(ENTRY.pack(offset, length))
+        self.file.write(FOOTER.pack(table_offset, len(self.lengths), self.total_length,
+                                    self.min_length or 0, MAGIC))
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class DocStore:
+    """
+    Read only view over a doc store file, lookups go straight to the mmap
+    """
+    def __init__(self, path=DOC_STORE_FILE):
+        self.path = path
+        self.file = open(path, 'rb')
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        (self.table_offset, self.count, self.total_length,
+         self.min_length, magic) = FOOTER.unpack_from(self.data, len(self.data) - FOOTER.size)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a doc store file")
+        self.avg_length = self.total_length / self.count if self.count else 0.0
+
+    def __len__(self):
+        return self.count
+
+    def _entry(self, docid: int):
+        if not 0 <= docid < self.count:
+            raise IndexError(f"docid {docid} out of range")
+        return ENTRY.unpack_from(self.data, self.table_offset + docid * ENTRY.size)
+
+    def url(self, docid: int) -> str:
+        start, _ = self._entry(docid)
+        end, _ = ENTRY.unpack_from(self.data, self.table_offset + (docid + 1) * ENTRY.size)
+        return self.data[start:end].decode('utf-8')
+
+    def length(self, docid: int) -> int:
+        return self._entry(docid)[1]
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+def extend_doc_store(docs: list, path=DOC_STORE_FILE, keep=None) -> int:
+    """
+    Appends (url, length) documents by writing a new store next to the old
+    one and renaming it over, so open readers keep the old file. Only the
+    first keep old documents are copied when it is given.
+    Returns the first new docid.
+    """
+    first = 0
+    tmp_path = path + ".tmp"
+    with DocStoreWriter(tmp_path) as writer:
+        if os.path.exists(path):
+            old = DocStore(path)
+            first = len(old) if keep is None else min(keep, len(old))
+            for docid in range(first):
+                writer.add(old.url(docid), old.length(docid))
+            old.close()
+        for url, length in docs:
+            writer.add(url, length)
+    os.replace(tmp_path, path)
+    return first
+
+def write_signatures(signatures: list, path=SIGNATURE_FILE):
+    """
+    (md5 digest, simhash) per document in docid order, renamed into place
+    """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        for digest, fingerprint in signatures:
+            f.write(SIGNATURE.pack(digest, fingerprint))
+    os.replace(tmp_path, path)
+
+def read_signatures(path=SIGNATURE_FILE) -> list:
+    if not os.path.exists(path):
+        return []
+    with open(path, 'rb') as f:
+        return list(SIGNATURE.iter_unpack(f.read()))
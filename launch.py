@@ -4,7 +4,11 @@ from argparse import ArgumentParser
 from utils.server_registration import get_cache_server
 from utils.config import Config
 from crawler import Crawler
+from crawler.frontier import AsyncFrontier
+from crawler.worker import AsyncWorker
+import scraper
 from scraper import write_report
+from stream_index import StreamIndexer
 
 
 def main(config_file, restart):
@@ -12,8 +16,19 @@ def main(config_file, restart):
     cparser.read(config_file)
     config = Config(cparser)
     config.cache_server = get_cache_server(config, restart)
-    crawler = Crawler(config, restart)
+    if config.stream_index:
+        # started before the crawler threads, the index process is forked
+        scraper.indexer = StreamIndexer(memory_mb=config.index_memory_mb,
+                                        positions=config.index_positions,
+                                        resume=not restart)
+        scraper.indexer.start()
+    if config.async_fetches:
+        crawler = Crawler(config, restart, AsyncFrontier, AsyncWorker)
+    else:
+        crawler = Crawler(config, restart)
     crawler.start()
+    if scraper.indexer is not None:
+        scraper.indexer.close()
     write_report()
 
 
@@ -0,0 +1,140 @@
+"""
+    Lexicon: sorted term -> postings location, binary searched over mmap
+"""
+
+import mmap
+import struct
+
+LEXICON_FILE = "master_index.lex"
+
+# fixed width entry: term offset into the heap, postings offset, postings length,
+# df, max term frequency (bounds the term's score when ranking)
+ENTRY = struct.Struct("<QQIII")
+# positional index entry: the same plus the positions offset and length
+POSITIONS_ENTRY = struct.Struct("<QQIIIQI")
+# footer: table offset, term count, magic
+FOOTER = struct.Struct("<QI4s")
+MAGIC = b"LEXI"
+POSITIONS_MAGIC = b"LEXP"
+
+class LexiconWriter:
+    """
+    Terms must be added in sorted order, which the merge already produces.
+    A positional lexicon also records where each term's positions are.
+    """
+    def __init__(self, path=LEXICON_FILE, positional: bool = False):
+        self.path = path
+        self.positional = positional
+        self.file = open(path, 'wb')
+        self.entries = []
+        self.heap_size = 0
+        self.last_term = None
+
+    def add(self, term: str, offset: int, length: int, df: int, max_tf: int,
+            positions: tuple = (0, 0)):
+        term_bytes = term.encode('utf-8')
+        if self.last_term is not None and term_bytes <= self.last_term:
+            raise ValueError(f"lexicon terms out of order: {term!r}")
+        self.file.write(term_bytes)
+        entry = (self.heap_size, offset, length, df, max_tf)
+        self.entries.append(entry + tuple(positions) if self.positional else entry)
+        self.heap_size += len(term_bytes)
+        self.last_term = term_bytes
+
+    def close(self):
+        if self.file.closed:
+            return
+        table_offset = self.heap_size
+        entry_struct = POSITIONS_ENTRY if self.positional else ENTRY
+        for entry in self.entries:
+            self.file.write(entry_struct.pack(*entry))
+        # sentinel so the last term's end is known
+        sentinel = (self.heap_size, 0, 0, 0, 0) + ((0, 0) if self.positional else ())
+        self.file.write(entry_struct.pack(*sentinel))
+        self.file.write(FOOTER.pack(table_offset, len(self.entries),
+                                    POSITIONS_MAGIC if self.positional else MAGIC))
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class Lexicon:
+    """
+    Opening only reads the footer, lookups binary search the mmapped table
+    """
+    def __init__(self, path=LEXICON_FILE):
+        self.path = path
+        self.file = open(path, 'rb')
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.table_offset, self.count, magic = FOOTER.unpack_from(
+            self.data, len(self.data) - FOOTER.size)
+        if magic not in (MAGIC, POSITIONS_MAGIC):
+            raise ValueError(f"{path} is not a lexicon file")
+        self.positional = magic == POSITIONS_MAGIC
+        self.entry = POSITIONS_ENTRY if self.positional else ENTRY
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, term):
+        return self.lookup(term) is not None
+
+    def _entry(self, i: int):
+        return self.entry.unpack_from(self.data, self.table_offset + i * self.entry.size)
+
+    def term(self, i: int) -> str:
+        start = self._entry(i)[0]
+        end = self._entry(i + 1)[0]
+        return self.data[start:end].decode('utf-8')
+
+    def entries(self, positions: bool = False):
+        """
+        Yields (term, postings offset, postings length, df, max tf) in term
+        order, with positions also (positions offset, positions length)
+        """
+        data = self.data
+        end = 7 if positions else 5
+        entry = self._entry(0) if self.count else None
+        for i in range(self.count):
+            next_entry = self._entry(i + 1)
+            yield (data[entry[0]:next_entry[0]].decode('utf-8'),) + entry[1:end]
+            entry = next_entry
+
+    def lookup(self, term: str):
+        """
+        Returns (postings offset, postings length, df, max tf) or None
+        """
+        entry = self._find(term)
+        return entry[1:5] if entry else None
+
+    def lookup_positions(self, term: str):
+        """
+        Returns (positions offset, positions length) or None
+        """
+        entry = self._find(term) if self.positional else None
+        return entry[5:] if entry else None
+
+    def _find(self, term: str):
+        key = term.encode('utf-8')
+        data = self.data
+        lo = 0
+        hi = self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            entry = self._entry(mid)
+            end = self._entry(mid + 1)[0]
+            mid_term = data[entry[0]:end]
+            if mid_term < key:
+                lo = mid + 1
+            elif mid_term > key:
+                hi = mid
+            else:
+                return entry
+        return None
+
+    def close(self):
+        self.data.close()
+        self.file.close()
@@ -0,0 +1,527 @@
+"""
+    Incremental index updates, LSM style: new pages are indexed into small
+    delta segments next to the base index, a manifest lists the live
+    segments in docid order and the deleted docids, and compaction merges
+    segments of similar size while dropping deleted documents.
+
+    python live_index.py add --root DEV      # pages changed since the last add
+    python live_index.py compact [--full]
+    python live_index.py search              # with compaction in the background
+"""
+
+import os
+import json
+import math
+import time
+import fcntl
+import heapq
+from array import array
+from bisect import bisect_left
+from contextlib import contextmanager
+from itertools import islice
+from argparse import ArgumentParser
+from threading import Thread, Event, Lock
+
+import tokenizer
+import simhash
+from build_index import collect_paths, parse_document, parse_text, ignore_parser_warnings, INDEX_MEMORY_MB
+from posting import add_postings, add_positional_postings
+from docstore import DocStore, DOC_STORE_FILE, extend_doc_store, write_signatures, read_signatures
+from lexicon import Lexicon
+from merge import (Segment, merge_runs, write_segment, positions_path, read_build_time,
+                   INDEX_FILE, MERGE_FAN_IN, SEGMENT_DIR, DELTA_DIR, MANIFEST_FILE)
+from search import Searcher, parse_query, RESULTS_TO_PRINT, POSTINGS_CACHE_MB, RESULT_CACHE_MB
+
+LOCK_FILE = "index_manifest.lock"
+BASE_NAME = os.path.splitext(INDEX_FILE)[0] # master_index.bin/.lex/.pos
+TIER_FACTOR = 4 # segment sizes within a tier are less than this far apart
+TIER_MERGE = 4 # adjacent segments in one tier that trigger a merge
+MIN_TIER_BYTES = 1024 * 1024 # smaller segments all share the lowest tier
+DELETED_RATIO = 0.25 # a segment with this share of deleted docs is rewritten alone
+COMPACT_INTERVAL = 60.0 # seconds between background compaction checks
+
+def segment_paths(name: str):
+    return f"{name}.bin", f"{name}.lex"
+
+def segment_bytes(name: str) -> int:
+    postings_path, lexicon_path = segment_paths(name)
+    paths = [postings_path, lexicon_path, positions_path(postings_path)]
+    return sum(os.path.getsize(path) for path in paths if os.path.exists(path))
+
+def remove_segment(name: str):
+    postings_path, lexicon_path = segment_paths(name)
+    for path in (postings_path, lexicon_path, positions_path(postings_path)):
+        if os.path.exists(path):
+            os.remove(path)
+
+def base_manifest() -> dict:
+    """
+    The manifest an index built by build_index.py starts with, the master
+    index is the only segment. Pages saved after the build are new.
+    """
+    manifest = {"generation": 0, "segments": [], "deleted": [], "doc_count": 0, "indexed_at": 0.0}
+    if os.path.exists(segment_paths(BASE_NAME)[1]) and os.path.exists(DOC_STORE_FILE):
+        # the build indexed every document in the doc store
+        docs = DocStore(DOC_STORE_FILE)
+        manifest["doc_count"] = len(docs)
+        if len(docs):
+            manifest["segments"].append({"name": BASE_NAME, "first": 0, "last": len(docs) - 1,
+                                         "docs": len(docs), "bytes": segment_bytes(BASE_NAME)})
+        docs.close()
+        # an index built before the time was recorded has the doc store's
+        manifest["indexed_at"] = read_build_time() or os.path.getmtime(DOC_STORE_FILE)
+    return manifest
+
+def load_manifest() -> dict:
+    if not os.path.exists(MANIFEST_FILE):
+        return base_manifest()
+    with open(MANIFEST_FILE, 'r') as f:
+        return json.load(f)
+
+def save_manifest(manifest: dict):
+    """
+    Renamed into place, so a reader sees the old or the new manifest whole
+    """
+    manifest["generation"] += 1
+    tmp_path = MANIFEST_FILE + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, MANIFEST_FILE)
+
+@contextmanager
+def manifest_lock():
+    """
+    Serializes writers across processes, readers never take it
+    """
+    with open(LOCK_FILE, 'w') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def remove_uncommitted(manifest: dict):
+    """
+    Delta segments of an add or compaction that died before saving the
+    manifest. Callers hold the manifest lock.
+    """
+    if not os.path.exists(DELTA_DIR):
+        return
+    live = {entry["name"] for entry in manifest["segments"]}
+    for f in os.listdir(DELTA_DIR):
+        path = os.path.join(DELTA_DIR, f)
+        if os.path.splitext(path)[0] not in live:
+            os.remove(path)
+
+def is_positional(manifest: dict) -> bool:
+    if not manifest["segments"]:
+        return False
+    lexicon = Lexicon(segment_paths(manifest["segments"][0]["name"])[1])
+    positional = lexicon.positional
+    lexicon.close()
+    return positional
+
+def changed_paths(root: str, since: float) -> list[str]:
+    return [path for path in collect_paths(root) if os.path.getmtime(path) > since]
+
+def parse_path(path: str, positional: bool):
+    try:
+        return parse_document(path, positional)
+    except json.JSONDecodeError:
+        print(f"JSON file could not be read: {path}")
+    except Exception as e:
+        print(f"Skipping file {path} due to error: {e}")
+    return None
+
+def parse_page(page: tuple, positional: bool):
+    url, text = page
+    return parse_text(url, text, positional)
+
+def add_documents(paths: list[str], memory_mb: float = INDEX_MEMORY_MB, started: float = None) -> int:
+    """
+    add_pages for saved json pages
+    """
+    return add_pages(paths, parse_path, memory_mb, started)
+
+def add_pages(pages, parse, memory_mb: float = INDEX_MEMORY_MB, started: float = None) -> int:
+    """
+    Indexes pages into new delta segments with docids after the existing
+    ones, parse(page, positional) gives parse_document's tuple or None.
+    started is when the pages were collected, the next add looks for pages
+    saved after it, by default now.
+    A page whose url is indexed with the same text is skipped, with new
+    text the old docid is deleted. Exact and near duplicates of live
+    pages are skipped like in build_index. The manifest is saved last, so
+    searchers see the whole batch at once, and documents past its doc_count
+    are from an add that died before that and are written over.
+    Returns the pages added.
+    """
+    if started is None:
+        started = time.time()
+    with manifest_lock():
+        manifest = load_manifest()
+        if not os.path.exists(MANIFEST_FILE):
+            # the build's doc count and time, before the doc store changes
+            save_manifest(manifest)
+        remove_uncommitted(manifest)
+        positional = is_positional(manifest)
+        tokenizer.stem_cache.load(tokenizer.STEM_TABLE_FILE)
+        deleted = set(manifest["deleted"])
+
+        latest = {} # url -> live docid
+        next_docid = 0
+        uncommitted = False
+        if os.path.exists(DOC_STORE_FILE):
+            docs = DocStore(DOC_STORE_FILE)
+            # a manifest without doc_count always matched the doc store
+            next_docid = min(manifest.get("doc_count", len(docs)), len(docs))
+            uncommitted = len(docs) > next_docid
+            for docid in range(next_docid):
+                if docid not in deleted:
+                    latest[docs.url(docid)] = docid
+            docs.close()
+        signatures = read_signatures()[:next_docid]
+        # an index built before signatures were saved has none for its docs
+        missing = [(bytes(16), 0)] * (next_docid - len(signatures))
+        signatures += missing
+        hashes = set()
+        near_duplicates = simhash.SimHashIndex()
+        for docid, (digest, fingerprint) in enumerate(signatures):
+            if docid not in deleted and fingerprint:
+                hashes.add(digest)
+                near_duplicates.add(fingerprint)
+
+        add = add_positional_postings if positional else add_postings
+        budget = memory_mb * 1024 * 1024
+        Index = {}
+        estimate = 0
+        new_docs = []
+        first = next_docid
+
+        def spill():
+            name = f"delta_{manifest['generation']}_{len(manifest['segments'])}"
+            write_segment(Index, name, positional, DELTA_DIR)
+            name = os.path.join(DELTA_DIR, name)
+            last = next_docid + len(new_docs) - 1
+            manifest["segments"].append({"name": name, "first": first, "last": last,
+                                         "docs": last - first + 1, "bytes": segment_bytes(name)})
+            Index.clear()
+
+        for page in pages:
+            parsed = parse(page, positional)
+            if parsed is None:
+                continue
+
+            url, hash_val, length, frequency, fingerprint = parsed
+            digest = bytes.fromhex(hash_val)
+            old = latest.get(url)
+            if old is not None and signatures[old][0] == digest:
+                continue
+            # a changed page replaces its old version even if it is near it
+            if digest in hashes or (old is None and near_duplicates.check_and_add(fingerprint)):
+                continue
+            if old is not None:
+                deleted.add(old)
+                hashes.discard(signatures[old][0])
+                near_duplicates.add(fingerprint)
+            docid = next_docid + len(new_docs)
+            latest[url] = docid
+            hashes.add(digest)
+            signatures.append((digest, fingerprint))
+            new_docs.append((url, length))
+            estimate += add(Index, docid, frequency)
+            if estimate >= budget:
+                spill()
+                first = docid + 1
+                estimate = 0
+        if Index:
+            spill()
+
+        if new_docs or uncommitted:
+            extend_doc_store(new_docs, keep=next_docid)
+            write_signatures(signatures)
+        if new_docs:
+            tokenizer.stem_cache.save(tokenizer.STEM_TABLE_FILE)
+        manifest["doc_count"] = next_docid + len(new_docs)
+        manifest["deleted"] = sorted(deleted)
+        manifest["indexed_at"] = max(manifest["indexed_at"], started)
+        save_manifest(manifest)
+    print(f"Added {len(new_docs)} pages, {len(manifest['segments'])} segments, "
+          f"{len(manifest['deleted'])} deleted docs")
+    return len(new_docs)
+
+def tier(size: int) -> int:
+    if size < MIN_TIER_BYTES:
+        return 0
+    return 1 + int(math.log(size / MIN_TIER_BYTES, TIER_FACTOR))
+
+def deleted_in(entry: dict, deleted: list) -> list:
+    """
+    The deleted docids inside a segment's docid range, deleted is sorted
+    """
+    lo = bisect_left(deleted, entry["first"])
+    hi = bisect_left(deleted, entry["last"] + 1)
+    return deleted[lo:hi]
+
+def plan_compaction(manifest: dict, full: bool = False) -> list:
+    """
+    Runs of adjacent segments to merge as (start, end) slices of the
+    manifest's segments. TIER_MERGE or more neighbours in one size tier
+    merge together, like size-tiered compaction, only neighbours so each
+    merged segment still covers one docid range. A segment with many
+    deleted docs is rewritten on its own. full merges everything into one.
+    """
+    segments = manifest["segments"]
+    deleted = manifest["deleted"]
+    if full:
+        return [(0, len(segments))] if len(segments) > 1 or deleted else []
+    runs = []
+    start = 0
+    for end in range(1, len(segments) + 1):
+        if end < len(segments) and tier(segments[end]["bytes"]) == tier(segments[start]["bytes"]):
+            continue
+        if end - start >= TIER_MERGE:
+            runs.append((start, end))
+        else:
+            for i in range(start, end):
+                if len(deleted_in(segments[i], deleted)) >= DELETED_RATIO * segments[i]["docs"]:
+                    runs.append((i, i + 1))
+        start = end
+    return runs
+
+def merge_run(entries: list, deleted: list, name: str, fan_in: int = MERGE_FAN_IN) -> dict:
+    """
+    Merges adjacent segments into one, dropping their deleted docs.
+    Returns the new manifest entry, or None if no document is left.
+    """
+    segments = []
+    dropped = 0
+    for entry in entries:
+        remap = None
+        gone = deleted_in(entry, deleted)
+        if gone:
+            # docids stay global, deleted ones map to -1
+            remap = array('i', range(entry["last"] + 1))
+            for docid in gone:
+                remap[docid] = -1
+            dropped += len(gone)
+        segments.append(Segment(*segment_paths(entry["name"]), 0, remap))
+    postings_path, lexicon_path = segment_paths(name)
+    merge_runs(segments, postings_path, lexicon_path, fan_in, f"compact_{os.path.basename(name)}")
+    if not os.path.getsize(postings_path):
+        remove_segment(name)
+        return None
+    return {"name": name, "first": entries[0]["first"], "last": entries[-1]["last"],
+            "docs": sum(entry["docs"] for entry in entries) - dropped, "bytes": segment_bytes(name)}
+
+def compact(full: bool = False, fan_in: int = MERGE_FAN_IN) -> int:
+    """
+    Merges what plan_compaction finds until nothing is left to merge. The
+    old files are removed after the new manifest is saved, a searcher that
+    still has them mapped keeps reading them until it refreshes.
+    Returns the number of merges.
+    """
+    merges = 0
+    with manifest_lock():
+        remove_uncommitted(load_manifest())
+        while True:
+            manifest = load_manifest()
+            runs = plan_compaction(manifest, full)
+            if not runs:
+                break
+            for directory in (DELTA_DIR, SEGMENT_DIR):
+                if not os.path.exists(directory):
+                    os.makedirs(directory)
+            segments = manifest["segments"]
+            deleted = manifest["deleted"]
+            merged = []
+            removed = []
+            previous = 0
+            for run_num, (start, end) in enumerate(runs):
+                merged.extend(segments[previous:start])
+                name = os.path.join(DELTA_DIR, f"segment_{manifest['generation']}_{run_num}")
+                entry = merge_run(segments[start:end], deleted, name, fan_in)
+                if entry is not None:
+                    merged.append(entry)
+                removed.extend(segments[start:end])
+                previous = end
+            merged.extend(segments[previous:])
+
+            # their documents are gone from the postings now
+            dropped = set()
+            for entry in removed:
+                dropped.update(deleted_in(entry, deleted))
+            manifest["segments"] = merged
+            manifest["deleted"] = [docid for docid in deleted if docid not in dropped]
+            save_manifest(manifest)
+            for entry in removed:
+                remove_segment(entry["name"])
+            merges += len(runs)
+            print(f"Compacted {len(removed)} segments into {len(runs)}, {len(merged)} live segments")
+            full = False
+    return merges
+
+class Compactor(Thread):
+    ''' Runs compact() every interval seconds until stopped. '''
+    def __init__(self, interval: float = COMPACT_INTERVAL):
+        self.interval = interval
+        self.stopped = Event()
+        super().__init__(daemon=True)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            compact()
+
+    def stop(self):
+        self.stopped.set()
+
+class LiveSearcher:
+    """
+    Searches the base and delta segments of the manifest together. Every
+    segment searcher shares one doc store and the deleted docids, and
+    document frequencies are summed over the segments, so scores are those
+    of one index over the same documents. refresh() picks up adds and
+    compactions, segments that did not change keep their caches.
+    """
+    def __init__(self, postings_cache_mb=POSTINGS_CACHE_MB, result_cache_mb=RESULT_CACHE_MB):
+        self.postings_cache_mb = postings_cache_mb
+        self.result_cache_mb = result_cache_mb
+        self.lock = Lock()
+        self.generation = None
+        self.docs = None
+        self.searchers = [] # (name, Searcher) in docid order
+        self.refresh()
+
+    def refresh(self) -> bool:
+        """
+        Reopens the index if the manifest changed, returns True if it did
+        """
+        failed = None
+        while True:
+            manifest = load_manifest()
+            if manifest["generation"] == self.generation:
+                return False
+            docs = DocStore(DOC_STORE_FILE)
+            try:
+                searchers = self.open_segments(manifest, docs)
+                break
+            except FileNotFoundError:
+                # compaction removes segments right after saving the next
+                # manifest, which lists what replaced them
+                docs.close()
+                if manifest["generation"] == failed:
+                    raise
+                failed = manifest["generation"]
+        tokenizer.stem_cache.load(tokenizer.STEM_TABLE_FILE)
+
+        with self.lock:
+            for _, searcher in searchers:
+                if searcher.docs is not docs:
+                    # more documents change every score
+                    searcher.docs = docs
+                    searcher.result_cache.clear()
+                searcher.set_deleted(manifest["deleted"])
+            old_docs = self.docs
+            self.searchers = searchers
+            self.docs = docs
+            self.generation = manifest["generation"]
+        if old_docs is not None:
+            old_docs.close()
+        return True
+
+    def open_segments(self, manifest: dict, docs) -> list:
+        """
+        (name, Searcher) per segment, reusing the ones already open
+        """
+        opened = dict(self.searchers)
+        searchers = []
+        for entry in manifest["segments"]:
+            searcher = opened.get(entry["name"])
+            if searcher is None:
+                postings_path, lexicon_path = segment_paths(entry["name"])
+                searcher = Searcher(postings_path, DOC_STORE_FILE, lexicon_path,
+                                    self.postings_cache_mb, self.result_cache_mb, docs)
+            searchers.append((entry["name"], searcher))
+        return searchers
+
+    def document_frequencies(self, searchers, terms) -> dict:
+        dfs = {}
+        for term in terms:
+            df = 0
+            for _, searcher in searchers:
+                entry = searcher.lexicon.lookup(term)
+                if entry is not None:
+                    df += entry[2]
+            if df:
+                dfs[term] = df
+        return dfs
+
+    def rank(self, query: str, k: int = RESULTS_TO_PRINT):
+        """
+        BM25 top k as (docid, score) over all live segments
+        """
+        with self.lock:
+            searchers = self.searchers
+            terms, phrases = parse_query(query)
+            dfs = self.document_frequencies(searchers, set(terms).union(*(phrase for phrase, _ in phrases)))
+            results = [searcher.rank(query, k, dfs) for _, searcher in searchers]
+        return list(islice(heapq.merge(*results, key=lambda r: (-r[1], r[0])), k))
+
+    def search(self, query: str):
+        """
+        AND (and phrase) matches as (docid, freq) in docid order, freq
+        comes from the shortest list in the document's segment
+        """
+        with self.lock:
+            return [result for _, searcher in self.searchers for result in searcher.search(query)]
+
+    def get_url(self, docid):
+        return self.docs.url(docid)
+
+    def close(self):
+        with self.lock:
+            self.searchers = []
+            if self.docs is not None:
+                self.docs.close()
+                self.docs = None
+
+if __name__ == "__main__":
+    ignore_parser_warnings()
+    parser = ArgumentParser()
+    parser.add_argument("command", choices=["add", "compact", "search"])
+    parser.add_argument("--root", type=str, default="/home/alvarov2/crawler_w26/DEV")
+    parser.add_argument("--all", action="store_true", help="check every page, not only the changed ones")
+    parser.add_argument("--memory-mb", type=float, default=INDEX_MEMORY_MB)
+    parser.add_argument("--full", action="store_true", help="compact into a single segment")
+    parser.add_argument("--interval", type=float, default=COMPACT_INTERVAL)
+    args = parser.parse_args()
+
+    if args.command == "add":
+        since = 0.0 if args.all else load_manifest()["indexed_at"]
+        # before the walk, a page saved during it may be missed by it
+        started = time.time()
+        add_documents(changed_paths(args.root, since), args.memory_mb, started)
+    elif args.command == "compact":
+        compact(args.full)
+    else:
+        searcher = LiveSearcher()
+        compactor = Compactor(args.interval)
+        compactor.start()
+        while True:
+            query = input("\nEnter search query (or 'q' to quit): ").strip()
+            if query.lower() == 'q':
+                compactor.stop()
+                searcher.close()
+                break
+            # adds from other processes and compactions show up here
+            searcher.refresh()
+            try:
+                results = searcher.rank(query, RESULTS_TO_PRINT)
+            except ValueError as e:
+                print(e)
+                continue
+            if not results:
+                print("No documents found.")
+            else:
+                for docid, score in results:
+                    print(f"DocID: {docid} // Score {score:.3f} // URL: {searcher.get_url(docid)}")
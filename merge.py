@@ -1,105 +1,379 @@
 import os
 import pickle
-import json
 import heapq
-from contextlib import ExitStack
-from posting import Posting 
-
-PICKLE_DIR = "index_pickle"
-TEXT_DIR = "index_text"
-
-def convert_pickles_to_sorted_text():
-    """
-    Step 1: Converts pickles into sorted text streams.
-    """
-    print("Step 1: Converting pickles to sorted text files...")
-    if not os.path.exists(TEXT_DIR):
-        os.makedirs(TEXT_DIR)
-
-    # gathers pickle file paths
-    pickle_files = [f for f in os.listdir(PICKLE_DIR) if f.endswith('.pickle')]
-    
-    for p_file in pickle_files:
-        pickle_path = os.path.join(PICKLE_DIR, p_file)
-        txt_name = p_file.replace('.pickle', '.txt')
-        txt_path = os.path.join(TEXT_DIR, txt_name)
-        
-        # loads one pickle into memory
-        with open(pickle_path, 'rb') as f:
-            partial_index = pickle.load(f)
-            
-        # alphabetically sorted and stores line by line
-        with open(txt_path, 'w', encoding='utf-8') as f:
-            for term in sorted(partial_index.keys()):
-                # convert the custom Posting objects into a simple list of [docid, freq]
-                # so json.dumps() can actually write it to a text file.
-                postings_list = [[p.docid, p.tfidf, p.url] for p in partial_index[term]]
-                
-                postings_str = json.dumps(postings_list)
-                f.write(f"{term}\t{postings_str}\n")
-                
-        print(f"Converted {p_file} -> {txt_name}")
-        
-        # immediately clear memory JIC
-        del partial_index
-
-def merge_sorted_text_files(output_file="master_index.txt"):
-    """
-    Step 2: Uses a priority queue to merge all text files 
-    line-by-line without loading them entirely into memory.
-    """
-    print("\nStep 2: Starting Merge...")
-    # gathers all .txt files
-    txt_files = [os.path.join(TEXT_DIR, f) for f in os.listdir(TEXT_DIR) if f.endswith('.txt')]
-    
-    with ExitStack() as stack:
-        # open all files
-        files = [stack.enter_context(open(f, 'r', encoding='utf-8')) for f in txt_files]
-        
-        heap = []
-        for i, f in enumerate(files):
-            line = f.readline()
-            if line:
-                term, postings_str = line.strip().split('\t', 1)
-                postings = json.loads(postings_str)
-                heapq.heappush(heap, (term, postings, i))
-                
-        with open(output_file, 'w', encoding='utf-8') as out_f:
-            current_term = None
-            current_postings = []
-            
-            while heap:
-                term, postings, file_idx = heapq.heappop(heap)
-                
-                if current_term == term:
-                    # merge postings for the same word
-                    current_postings.extend(postings)
+import mmap
+from argparse import ArgumentParser
+from codec import (encode_postings, decode_postings_arrays, concat_postings, read_vbyte,
+                   encode_positions, split_positions, concat_positions, docid_range)
+from lexicon import Lexicon, LexiconWriter, LEXICON_FILE
+from docstore import DocStore, DOC_STORE_FILE, SIGNATURE_FILE
+
+SEGMENT_DIR = "index_segments"
+INDEX_FILE = "master_index.bin"
+POSITIONS_FILE = "master_index.pos" # only written for a positional index
+REMAP_FILE = "docid_remap.pickle"
+MERGE_FAN_IN = 16 # segments open at once, more than this merges in passes
+SHARD_DIR = "index_shards" # merge_segments(shards=N) output, shard_<i>.bin/.lex/.pos
+DELTA_DIR = "index_delta" # live_index.py segments added after the build
+MANIFEST_FILE = "index_manifest.json" # live_index.py segment list, gone after a rebuild
+BUILD_TIME_FILE = "index_built_at.txt" # when the build collected its pages, live_index.py adds newer ones
+
+def write_docid_remaps(remaps: dict):
+    """
+    Saves the shard local -> global docid maps from build_index, -1 marks a
+    document dropped as a duplicate of one in an earlier shard.
+    """
+    os.makedirs(SEGMENT_DIR, exist_ok=True)
+    with open(os.path.join(SEGMENT_DIR, REMAP_FILE), 'wb') as f:
+        pickle.dump(remaps, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+def write_build_time(collected_at: float, path: str = BUILD_TIME_FILE):
+    with open(path + ".tmp", 'w') as f:
+        f.write(repr(collected_at))
+    os.replace(path + ".tmp", path)
+
+def read_build_time(path: str = BUILD_TIME_FILE):
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        return float(f.read())
+
+def load_docid_remaps():
+    path = os.path.join(SEGMENT_DIR, REMAP_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+def positions_path(postings_path: str) -> str:
+    """
+    A positional index keeps positions next to its postings, x.bin -> x.pos
+    """
+    return os.path.splitext(postings_path)[0] + ".pos"
+
+def write_segment(Index: dict, name: str, positional: bool = False, directory: str = SEGMENT_DIR):
+    """
+    Spills an in-memory index straight to a term sorted segment, which has
+    the same postings + lexicon layout as the master index. A positional
+    segment's postings are PositionalPostings and also get a positions file.
+    Returns the size of the segment in KB.
+    """
+    # build_index's pool workers spill at the same time on a fresh directory
+    os.makedirs(directory, exist_ok=True)
+    postings_path = os.path.join(directory, f"{name}.bin")
+    lexicon_path = os.path.join(directory, f"{name}.lex")
+    paths = [postings_path, lexicon_path]
+    pos_f = None
+    if positional:
+        paths.append(positions_path(postings_path))
+        pos_f = open(paths[-1], 'wb')
+    with open(postings_path, 'wb') as out_f, LexiconWriter(lexicon_path, positional) as lexicon:
+        for term in sorted(Index.keys()):
+            postings = Index[term]
+            write_record(out_f, lexicon, term, [(p.docid, p.tfidf) for p in postings],
+                         pos_f, [p.positions for p in postings] if positional else None)
+    if pos_f:
+        pos_f.close()
+    return sum(os.path.getsize(path) for path in paths) / 1024
+
+def write_record(out_f, lexicon: LexiconWriter, term: str, postings: list, pos_f=None, positions=None):
+    """
+    Appends one term's binary postings, and with pos_f its positions given
+    as encode_doc_positions output per posting, and records where they went
+    in the lexicon
+    """
+    postings_bytes = encode_postings(postings)
+    max_tf = max(p[1] for p in postings)
+    location = (0, 0)
+    if pos_f is not None:
+        positions_bytes = encode_positions(positions)
+        location = (pos_f.tell(), len(positions_bytes))
+        pos_f.write(positions_bytes)
+    lexicon.add(term, out_f.tell(), len(postings_bytes), len(postings), max_tf, location)
+    out_f.write(postings_bytes)
+
+def segment_names():
+    """
+    index_<shard>_<n> segments in docid order
+    """
+    names = [f[:-4] for f in os.listdir(SEGMENT_DIR) if f.startswith('index_') and f.endswith('.lex')]
+    return sorted(names, key=lambda name: tuple(int(x) for x in name.split('_')[1:]))
+
+def shard_paths(shard: int, shard_dir: str = SHARD_DIR):
+    """
+    (postings path, lexicon path) of one shard, positions follow positions_path
+    """
+    return os.path.join(shard_dir, f"shard_{shard}.bin"), os.path.join(shard_dir, f"shard_{shard}.lex")
+
+def count_shards(shard_dir: str = SHARD_DIR) -> int:
+    if not os.path.exists(shard_dir):
+        return 0
+    return sum(1 for f in os.listdir(shard_dir) if f.startswith('shard_') and f.endswith('.lex'))
+
+def clear_segments():
+    """
+    Old segments would otherwise be merged into the new index. A rebuild
+    also starts a new doc store, so incremental updates to the old index go.
+    """
+    for path in (MANIFEST_FILE, SIGNATURE_FILE, BUILD_TIME_FILE):
+        if os.path.exists(path):
+            os.remove(path)
+    for directory in (SEGMENT_DIR, DELTA_DIR):
+        if not os.path.exists(directory):
+            continue
+        for f in os.listdir(directory):
+            if f.endswith(('.bin', '.lex', '.pos', '.pickle')):
+                os.remove(os.path.join(directory, f))
+
+def map_file(f):
+    if os.fstat(f.fileno()).st_size:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return b""
+
+class Segment:
+    """
+    One segment to merge. Docids are shifted by offset, or mapped through
+    remap (dropping -1) when the shard lost documents to dedup. With
+    docs=(lo, hi) only postings for docids lo <= docid < hi are kept.
+    Files are opened by open(), so merge_runs only has the group it is
+    merging open.
+    """
+    def __init__(self, postings_path, lexicon_path, offset=0, remap=None, docs=None):
+        self.postings_path = postings_path
+        self.lexicon_path = lexicon_path
+        self.offset = offset
+        self.remap = remap
+        self.docs = docs
+        self.lexicon = None
+
+    def open(self):
+        self.lexicon = Lexicon(self.lexicon_path)
+        self.positional = self.lexicon.positional
+        self.file = open(self.postings_path, 'rb')
+        self.data = map_file(self.file)
+        if self.positional:
+            self.positions_file = open(positions_path(self.postings_path), 'rb')
+            self.positions = map_file(self.positions_file)
+        return self
+
+    def reopen(self, docs=None):
+        """
+        Another view of the same files, e.g. for one shard's docid range
+        """
+        return Segment(self.postings_path, self.lexicon_path, self.offset, self.remap, docs)
+
+    def terms(self):
+        """
+        Yields (term, encoded postings, docid offset, max tf, encoded positions)
+        in term order, positions are None unless the segment is positional
+        """
+        lo, hi = self.docs or (0, float('inf'))
+        for term, offset, length, _, max_tf, *location in self.lexicon.entries(self.positional):
+            data = self.data[offset:offset + length]
+            positions = None
+            if location:
+                positions = self.positions[location[0]:location[0] + location[1]]
+            if self.remap is None:
+                inside = True
+                if self.docs:
+                    first, last = docid_range(data)
+                    if last + self.offset < lo or first + self.offset >= hi:
+                        continue
+                    inside = first + self.offset >= lo and last + self.offset < hi
+                if inside:
+                    yield term, data, self.offset, max_tf, positions
+                    continue
+            # only shards that lost documents, and lists crossing a shard
+            # boundary, pay for a decode here
+            docids, freqs = decode_postings_arrays(data)
+            if self.remap is None:
+                mapped = [d + self.offset for d in docids]
+            else:
+                mapped = [self.remap[d] for d in docids]
+            keep = [lo <= d < hi for d in mapped]
+            postings = [(d, f) for d, f, k in zip(mapped, freqs, keep) if k]
+            if not postings:
+                continue
+            if positions is not None:
+                positions = encode_positions([p for p, k in zip(split_positions(positions), keep) if k])
+            yield term, encode_postings(postings), 0, max(f for _, f in postings), positions
+
+    def close(self):
+        if self.lexicon is None:
+            return
+        for data in (self.data, getattr(self, 'positions', None)):
+            if isinstance(data, mmap.mmap):
+                data.close()
+        self.file.close()
+        if self.positional:
+            self.positions_file.close()
+        self.lexicon.close()
+        self.lexicon = None
+
+    def remove(self):
+        self.close()
+        for path in (self.postings_path, self.lexicon_path, positions_path(self.postings_path)):
+            if os.path.exists(path):
+                os.remove(path)
+
+def merge_segment_group(segments: list, output_file: str, lexicon_file: str):
+    """
+    k-way merge by term. Segments are given in docid order, so a term's
+    lists are joined with concat_postings without decoding them. Positions
+    are kept when every segment has them.
+    """
+    for segment in segments:
+        segment.open()
+    positional = bool(segments) and all(segment.positional for segment in segments)
+    pos_f = open(positions_path(output_file), 'wb') if positional else None
+    iterators = [segment.terms() for segment in segments]
+    heap = []
+    for i, it in enumerate(iterators):
+        item = next(it, None)
+        if item is not None:
+            heap.append((item[0], i, item))
+    heapq.heapify(heap)
+
+    with open(output_file, 'wb') as out_f, LexiconWriter(lexicon_file, positional) as lexicon:
+        while heap:
+            term = heap[0][0]
+            parts = []
+            position_parts = []
+            max_tf = 0
+            # the same term from several segments pops in segment (docid) order
+            while heap and heap[0][0] == term:
+                _, i, (_, data, offset, part_max_tf, positions) = heapq.heappop(heap)
+                parts.append((data, offset))
+                position_parts.append(positions)
+                max_tf = max(max_tf, part_max_tf)
+                item = next(iterators[i], None)
+                if item is not None:
+                    heapq.heappush(heap, (item[0], i, item))
+
+            if len(parts) == 1 and parts[0][1] == 0:
+                postings_bytes = parts[0][0]
+            else:
+                postings_bytes = concat_postings(parts)
+            df, _ = read_vbyte(postings_bytes, 0)
+            location = (0, 0)
+            if positional:
+                if len(position_parts) == 1:
+                    positions_bytes = position_parts[0]
                 else:
-                    # new word found, writes the previous word's data to disk
-                    if current_term is not None:
-                        # sort by doc id
-                        current_postings.sort(key=lambda x: x[0]) 
-                        merged_str = json.dumps(current_postings)
-                        out_f.write(f"{current_term}\t{merged_str}\n")
-                        
-                    current_term = term
-                    current_postings = postings
-                    
-                # pulls next word from file just processed
-                next_line = files[file_idx].readline()
-                if next_line:
-                    next_term, next_postings_str = next_line.strip().split('\t', 1)
-                    next_postings = json.loads(next_postings_str)
-                    heapq.heappush(heap, (next_term, next_postings, file_idx))
-            
-            # writes final word
-            if current_term is not None:
-                current_postings.sort(key=lambda x: x[0])
-                merged_str = json.dumps(current_postings)
-                out_f.write(f"{current_term}\t{merged_str}\n")
+                    positions_bytes = concat_positions(position_parts)
+                location = (pos_f.tell(), len(positions_bytes))
+                pos_f.write(positions_bytes)
+            lexicon.add(term, out_f.tell(), len(postings_bytes), df, max_tf, location)
+            out_f.write(postings_bytes)
+    if pos_f:
+        pos_f.close()
 
+def spilled_segments():
+    """
+    The build's spilled segments, not opened yet, with each shard's docid
+    mapping and the (lowest, highest) global docid the shard can hold, None
+    for a shard that kept no document. A shard that kept all of its documents
+    is a plain docid shift. Without remaps the range is unknown, every docid.
+    """
+    remaps = load_docid_remaps()
+    spans = {}
+    for shard_num, remap in remaps.items():
+        kept = [d for d in remap if d >= 0]
+        spans[shard_num] = (kept[0], kept[-1]) if kept else None
+    segments = []
+    for name in segment_names():
+        shard_num = int(name.split('_')[1])
+        remap = remaps.get(shard_num)
+        offset = 0
+        if remap is not None and spans[shard_num] is not None and \
+                spans[shard_num][1] - spans[shard_num][0] == len(remap) - 1:
+            offset = remap[0]
+            remap = None
+        segment = Segment(os.path.join(SEGMENT_DIR, f"{name}.bin"),
+                          os.path.join(SEGMENT_DIR, f"{name}.lex"), offset, remap)
+        segments.append((segment, spans.get(shard_num, (0, float('inf')))))
+    return segments
+
+def merge_segments(output_file=INDEX_FILE, lexicon_file=LEXICON_FILE, fan_in=MERGE_FAN_IN,
+                   shards: int = 1):
+    """
+    Merges the spilled segments into the master index and its lexicon.
+    With shards > 1 they are merged into that many shard indexes instead,
+    see merge_shards.
+    """
+    print("Merging segments...")
+    if shards > 1:
+        merge_shards(shards, fan_in)
+        return
+    merge_runs([segment for segment, _ in spilled_segments()], output_file, lexicon_file, fan_in)
     print(f"\nMerge complete! Final master index saved to {output_file}")
 
+def merge_shards(shards: int, fan_in: int = MERGE_FAN_IN, shard_dir: str = SHARD_DIR):
+    """
+    Splits the index into shards by document range, each a complete index
+    over about len(docs) / shards documents with global docids, so a shard
+    answers any query for its documents on its own. Segments are assigned
+    to the shards their docids fall in, and only postings lists that cross
+    a shard boundary are decoded and split.
+    """
+    if not os.path.exists(shard_dir):
+        os.makedirs(shard_dir)
+    for f in os.listdir(shard_dir):
+        if f.startswith('shard_'):
+            os.remove(os.path.join(shard_dir, f))
+
+    docs = DocStore(DOC_STORE_FILE)
+    n_docs = len(docs)
+    docs.close()
+    # an empty shard has nothing to map
+    shards = max(1, min(shards, n_docs))
+    bounds = [n_docs * i // shards for i in range(shards + 1)]
+
+    # a build shard's docids are increasing, so its range is known without
+    # opening its segments, merge_runs opens them fan_in at a time
+    segments = spilled_segments()
+    for shard in range(shards):
+        lo, hi = bounds[shard], bounds[shard + 1]
+        group = [segment.reopen((lo, hi)) for segment, span in segments
+                 if span is not None and span[0] < hi and span[1] >= lo]
+        postings_path, lexicon_path = shard_paths(shard, shard_dir)
+        merge_runs(group, postings_path, lexicon_path, fan_in, f"merge_s{shard}")
+        print(f"Shard {shard}: docids {lo}-{hi - 1} from {len(group)} segments")
+    print(f"\nMerge complete! {shards} shards saved to {shard_dir}")
+
+def merge_runs(segments: list, output_file: str, lexicon_file: str, fan_in: int = MERGE_FAN_IN,
+               prefix: str = "merge"):
+    """
+    At most fan_in segments are open at once. With more, neighbouring runs
+    are merged into intermediate segments first, which keeps docid order.
+    """
+    merge_pass = 0
+    while len(segments) > fan_in:
+        merge_pass += 1
+        merged = []
+        for start in range(0, len(segments), fan_in):
+            group = segments[start:start + fan_in]
+            name = os.path.join(SEGMENT_DIR, f"{prefix}_{merge_pass}_{start // fan_in}")
+            merge_segment_group(group, f"{name}.bin", f"{name}.lex")
+            for segment in group:
+                # spilled segments stay for the report, intermediates go
+                if merge_pass > 1:
+                    segment.remove()
+                else:
+                    segment.close()
+            merged.append(Segment(f"{name}.bin", f"{name}.lex"))
+        print(f"Merge pass {merge_pass}: {len(segments)} -> {len(merged)} segments")
+        segments = merged
+
+    merge_segment_group(segments, output_file, lexicon_file)
+    for segment in segments:
+        if merge_pass:
+            segment.remove()
+        else:
+            segment.close()
+
 if __name__ == "__main__":
-    convert_pickles_to_sorted_text()
-    merge_sorted_text_files()
\ No newline at end of file
+    parser = ArgumentParser()
+    parser.add_argument("--shards", type=int, default=1, help="split the index by document range")
+    args = parser.parse_args()
+    merge_segments(shards=args.shards)
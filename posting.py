@@ -1,7 +1,58 @@
+from codec import encode_doc_positions
+
+POSTING_BYTES = 56 # a Posting plus its slot in the postings list
+POSITIONS_BYTES = 48 # a PositionalPosting's encoded positions object and its slot
+POSITION_BYTES = 2 # one gap coded position
+TERM_BYTES = 150 # a new term's string header, empty postings list and dict slot
+MAX_TERM_LENGTH = 200 # longer tokens are not indexed
+
 class Posting:
-    __slots__ = ['docid', 'tfidf', 'url'] 
+    __slots__ = ['docid', 'tfidf'] 
     
-    def __init__(self, docid: int, tfidf: int, url: str = "none"):
+    def __init__(self, docid: int, tfidf: int):
         self.docid = docid
         self.tfidf = tfidf
-        self.url = url
\ No newline at end of file
+
+class PositionalPosting(Posting):
+    __slots__ = ['positions']
+
+    def __init__(self, docid: int, positions: list[int]):
+        super().__init__(docid, len(positions))
+        # kept gap coded, a list of ints would cost far more than the postings
+        self.positions = encode_doc_positions(positions)
+
+def add_postings(Index: dict, docid: int, frequency: dict) -> int:
+    """
+    Adds one document's term frequencies to an in-memory index.
+    Returns an estimate of the bytes this added, callers spill the index
+    to a segment once the running total passes their memory budget.
+    """
+    added = 0
+    for token, freq in frequency.items():
+        if len(token) > MAX_TERM_LENGTH:
+            continue
+        postings = Index.get(token)
+        if postings is None:
+            postings = Index[token] = []
+            added += TERM_BYTES + len(token)
+        postings.append(Posting(docid, freq))
+        added += POSTING_BYTES
+    return added
+
+
+def add_positional_postings(Index: dict, docid: int, positions: dict) -> int:
+    """
+    add_postings for a positional index, positions maps each term to its
+    ascending token positions in the document
+    """
+    added = 0
+    for token, token_positions in positions.items():
+        if len(token) > MAX_TERM_LENGTH:
+            continue
+        postings = Index.get(token)
+        if postings is None:
+            postings = Index[token] = []
+            added += TERM_BYTES + len(token)
+        postings.append(PositionalPosting(docid, token_positions))
+        added += POSTING_BYTES + POSITIONS_BYTES + POSITION_BYTES * len(token_positions)
+    return added
@@ -3,13 +3,33 @@ from urllib.parse import urlparse, urljoin, urldefrag
 from bs4 import BeautifulSoup
 import hashlib
 from collections import Counter
+from threading import Lock
+import simhash
+import url_filter
+from utils.metrics import metrics
 # import tokenizer here
 
+try:
+    import lxml.html
+    from lxml import etree
+except ImportError:
+    lxml = None
+
+MAX_PAGE_BYTES = 2_000_000
+MIN_PAGE_WORDS = 50
+HIDDEN_TAGS = ("script", "style", "noscript")
+HTML_TYPES = ("text/html", "application/xhtml")
+
 seen_hashes = set()
+near_duplicates = simhash.SimHashIndex()
 word_counts = {}
 unique_urls = set()
 top_50_counter = Counter()
 subdomain_count = {}
+# worker and parser threads share the globals above
+stats_lock = Lock()
+# a stream_index.StreamIndexer when pages are indexed during the crawl
+indexer = None
 
 stopwords = set("""
 i me my myself we our ours ourselves you your yours yourself yourselves he him his she her hers herself it its itself they them their theirs themselves what which who whom this that these
@@ -30,62 +50,135 @@ def add_subdomain(url):
     parsed = urlparse(url)
     loc = parsed.netloc.lower()
     if loc.endswith("uci.edu"):
-        subdomain_count[loc] = subdomain_count.get(loc, 0) + 1
+        with stats_lock:
+            subdomain_count[loc] = subdomain_count.get(loc, 0) + 1
 
-def add_word_count(text):
-    text = re.findall(r"[a-z0-9]+", text.lower())
-    words = [w for w in text if w not in stopwords and not is_number(w)]
-    top_50_counter.update(words)
+def add_word_count(words):
+    counts = Counter(w for w in words if w not in stopwords and not is_number(w))
+    with stats_lock:
+        top_50_counter.update(counts)
 
 def add_unique_urls(url):
     url, _ = urldefrag(url)
-    unique_urls.add(url)
+    with stats_lock:
+        unique_urls.add(url)
+
+def content_type(resp):
+    headers = getattr(resp.raw_response, "headers", None)
+    return headers.get("Content-Type", "") if headers else ""
+
+def is_html(ctype):
+    # pages from the cache may come without a content type, those are parsed
+    return not ctype or any(t in ctype.lower() for t in HTML_TYPES)
+
+def decode_html(html, ctype):
+    # lxml assumes latin-1 for bytes without a meta charset, so decode first
+    if isinstance(html, str):
+        return html
+    match = re.search(r"charset=([\w-]+)", ctype, re.I)
+    for encoding in (match.group(1) if match else None, "utf-8"):
+        if encoding:
+            try:
+                return html.decode(encoding)
+            except (LookupError, UnicodeDecodeError):
+                pass
+    return html.decode("cp1252", errors="replace")
+
+def parse_page(html, base_url, ctype=""):
+    """
+    Parses a page once and returns (links, visible text). Links are
+    absolute and without fragments, the text is lower case with runs of
+    whitespace collapsed. Uses lxml when installed, else html.parser.
+    """
+    links = []
+    if lxml is not None:
+        try:
+            root = lxml.html.document_fromstring(decode_html(html, ctype))
+        except ValueError:
+            # str input with an xml encoding declaration, let lxml decode it
+            root = lxml.html.document_fromstring(html)
+        for tag in root.iter("a"):
+            href = tag.get("href")
+            if href is not None:
+                links.append(urldefrag(urljoin(base_url, href))[0])
+        etree.strip_elements(root, *HIDDEN_TAGS, with_tail=False)
+        text = " ".join(root.itertext())
+    else:
+        soup = BeautifulSoup(html, "html.parser")
+        for tag in soup.find_all("a", href=True):
+            links.append(urldefrag(urljoin(base_url, tag.get("href")))[0])
+        for tag in soup(HIDDEN_TAGS):
+            tag.decompose()
+        text = soup.get_text(" ")
+    return links, re.sub(r"\s+", " ", text).lower()
 
 def get_visible_text(html):
-    soup = BeautifulSoup(html, 'html.parser')
-    for tag in soup(["script", "style", "noscript"]):
-        tag.decompose()
-    text = soup.get_text(" ")
-    return re.sub(r"\s+", " ", text).lower()
+    return parse_page(html, "")[1]
 
 def is_duplicate_page(text):
     hash = hashlib.md5(text.encode()).hexdigest()
-    if hash in seen_hashes:
-        return True
-    seen_hashes.add(hash)
-    return False
+    # checked and added together, or two copies parsed at once both pass
+    with stats_lock:
+        if hash in seen_hashes:
+            return True
+        seen_hashes.add(hash)
+        return False
+
+def is_near_duplicate(words):
+    # simhash over word shingles, templated pages that differ in a few words collide
+    return near_duplicates.check_and_add(simhash.fingerprint(simhash.shingles(words)))
 
 def scraper(url, resp):
 
+    # rejections that need no parsing first
     if resp.status != 200 or not resp.raw_response or not resp.raw_response.content:
         return []
 
-    links = extract_next_links(url, resp)
-
     html = resp.raw_response.content
 
-    if len(html) > 2_000_000:
+    if len(html) > MAX_PAGE_BYTES:
         return []
 
-    text = get_visible_text(html)
+    ctype = content_type(resp)
+    if not is_html(ctype):
+        return []
 
-    if is_duplicate_page(text):
+    try:
+        with metrics.timer("parse"):
+            links, text = parse_page(html, resp.url, ctype)
+    except Exception as e:
+        print(f"Error with {url}: {e}")
         return []
 
-    if len(text.split()) < 50:
+    with metrics.timer("dedup"):
+        # words for the fingerprint and the report, split once
+        words = re.findall(r"[a-z0-9]+", text)
+        duplicate = is_duplicate_page(text) or is_near_duplicate(words)
+    if duplicate:
+        metrics.count("duplicates")
         return []
 
+    if indexer is not None:
+        # the visible text is already here, no need to parse the page again offline
+        with metrics.timer("index_submit"):
+            indexer.submit(url, text)
+
     wc = len(text.split())
-    word_counts[url] = wc
-    add_word_count(text)
+    if wc < MIN_PAGE_WORDS:
+        return []
+
+    with stats_lock:
+        word_counts[url] = wc
+    add_word_count(words)
 
     url_no_frag, _ = urldefrag(url)
-    unique_urls.add(url_no_frag)
+    add_unique_urls(url_no_frag)
     add_subdomain(url_no_frag)
 
     # can add word count stuff here using tokenizer
 
-    return [link for link in links if is_valid(link)]
+    with metrics.timer("filter"):
+        return url_filter.filter_urls(links)
 
 def extract_next_links(url, resp):
     """
@@ -100,121 +193,23 @@ def extract_next_links(url, resp):
     # resp.raw_response.content: the content of the page!
     # Return a list with the hyperlinks (as strings) scrapped from resp.raw_response.content
 
-    links = []
-
     if resp.status != 200 or resp.raw_response is None:
-        return links
+        return []
 
     try:
-        content = resp.raw_response.content
-        soup = BeautifulSoup(content, "html.parser")
-
-        for tag in soup.find_all("a", href=True):
-            href = tag.get("href")
-
-            # resolve relative urls
-            abs_url = urljoin(resp.url, href)
-
-            # removes fragments from urls
-            abs_url, _ = urldefrag(abs_url)
-
-            links.append(abs_url)
-
+        return parse_page(resp.raw_response.content, resp.url, content_type(resp))[0]
     except Exception as e:
         print(f"Error with {url}: {e}")
         return []
 
-    return links
-
 def is_valid(url):
     # Decide whether to crawl this url or not. 
     # If you decide to crawl it, return True; otherwise return False.
-    # There are already some conditions that return False.
-
+    # The rules are compiled and their decisions cached in url_filter.
     try:
-        parsed = urlparse(url)
-
-        # only http(s) protocol
-        if parsed.scheme not in {"http", "https"}:
-            return False
-
-        # domain restrictions
-        allowed_domains = (
-            ".ics.uci.edu",
-            ".cs.uci.edu",
-            ".informatics.uci.edu",
-            ".stat.uci.edu"
-        )
-
-        blocked_subdomains = (
-		    "grape.ics.uci.edu",
-            "calendar.ics.uci.edu",
-            "intranet.ics.uci.edu",
-            "login.uci.edu",
-            "auth.uci.edu",
-            "mail.ics.uci.edu",
-            "webmail.uci.edu",
-            "bugs.ics.uci.edu",
-            "jira.ics.uci.edu"
-        )
-
-        if re.search(r"/~[^/]+/", parsed.path):
-            return False
-
-        if parsed.netloc in blocked_subdomains:
-            return False
-
-        if parsed.netloc.startswith("grape."):
-            return False
-
-        if not any(parsed.netloc.endswith(d) for d in allowed_domains):
-            return False
-        if "calendar" in parsed.path or "events" in parsed.path or "/event/" in parsed.path or "grape.ics" in parsed.path:
-            if re.search(r"\d{4}[-/]\d{2}", parsed.path):
-                return False
-            if "tag" in parsed.path or "page" in parsed.path:
-                return False
-        if "ical=" in url:
-            return False
-
-        # Filter file types (given regex)
-        if re.match(
-            r".*\.(css|js|bmp|gif|jpe?g|ico"
-            r"|png|tiff?|mid|mp2|mp3|mp4"
-            r"|wav|avi|mov|mpeg|ram|m4v|mkv|ogg|ogv|pdf|mpg"
-            r"|ps|eps|tex|ppt|pptx|doc|docx|xls|xlsx|names"
-            r"|data|dat|exe|bz2|tar|msi|bin|7z|psd|dmg|iso"
-            r"|epub|dll|cnf|tgz|sha1"
-            r"|thmx|mso|arff|rtf|jar|csv"
-            r"|rm|smil|wmv|swf|wma|zip|rar|gz)$",
-            parsed.path.lower()
-        ):
-            return False
-        
-        if "doku.php" in parsed.path:
-            return False
-        if parsed.query.count("=") > 2:
-            return False
-        if "?" in parsed.path and parsed.query.count("=") > 2:
-            return False
-
-        # spider trap prevention
-        # Very long URLs (often traps)
-        if len(url) > 300:
-            return False
-
-        # calendar loops
-        if re.search(r"(\/[^\/]+){10,}", parsed.path):
-            return False
-
-        # query explosion
-        if parsed.query.count("=") > 5:
-            return False
-
-        return True
-
+        return url_filter.is_valid(url)
     except TypeError:
-        print ("TypeError for ", parsed)
+        print ("TypeError for ", url)
         raise
 
 def write_report(filename = "crawler_report.txt"):
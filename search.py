@@ -1,97 +1,392 @@
-import json
+import heapq
+import math
+import mmap
 import os
-from nltk.stem import PorterStemmer
+import re
+import tokenizer
+from array import array
+from itertools import accumulate
+from cache import LRUCache
+from codec import decode_postings, decode_postings_arrays, PostingsList, PositionsReader
+from docstore import DocStore, DOC_STORE_FILE
+from lexicon import Lexicon, LEXICON_FILE
+from merge import positions_path
 
-INDEX_FILE = "master_index.txt" # merge.py output file
+INDEX_FILE = "master_index.bin" # merge.py output file
 RESULTS_TO_PRINT = 5 # to not print every result
+K1 = 1.2 # BM25 term frequency saturation
+B = 0.75 # BM25 document length normalization
+POSTINGS_CACHE_MB = 64 # decoded postings kept between queries, 0 disables
+RESULT_CACHE_MB = 4 # normalized query -> results, 0 disables
+# "a quoted phrase", or "terms near each other"~N with up to N other tokens in between
+PHRASE_PATTERN = re.compile(r'"([^"]*)"(?:~(\d+))?')
+
+def sizeof_arrays(arrays):
+    return sum(len(a) * a.itemsize for a in arrays) + 128
+
+def sizeof_results(results):
+    # list slot + tuple + two numbers per result
+    return 100 * len(results) + 64
+
+def parse_query(query: str):
+    """
+    Splits a query into its bare terms and its phrases, all stemmed.
+    Phrases are (terms, slop) with slop None for an exact phrase. Phrase
+    text is tokenized like indexed text, so stop words between the terms
+    don't count, and a phrase of one term is a bare term.
+    """
+    phrases = []
+    terms = []
+    for match in PHRASE_PATTERN.finditer(query.lower()):
+        phrase = tuple(tokenizer.stem(token) for token in tokenizer.tokenize(match.group(1)))
+        if len(phrase) > 1:
+            phrases.append((phrase, int(match.group(2)) if match.group(2) else None))
+        else:
+            terms.extend(phrase)
+    terms.extend(tokenizer.stem(term) for term in PHRASE_PATTERN.sub(" ", query.lower()).split())
+    return terms, phrases
+
+def count_phrase(positions, slop=None) -> int:
+    """
+    positions gives each phrase term's positions in one document, in phrase
+    order. Without slop counts where the terms appear next to each other in
+    order, reading positions only until no start is left. With slop counts
+    the places where all of the terms, in any order, fall within a window
+    of len(terms) + slop tokens, the terms must then be distinct.
+    """
+    if slop is None:
+        positions = iter(positions)
+        starts = set(next(positions))
+        for offset, term_positions in enumerate(positions, 1):
+            starts.intersection_update(p - offset for p in term_positions)
+            if not starts:
+                break
+        return len(starts)
+
+    # smallest window covering every term that ends at each position
+    positions = list(positions)
+    window = len(positions) + slop
+    events = sorted((p, i) for i, term_positions in enumerate(positions) for p in term_positions)
+    in_window = {}
+    count = 0
+    left = 0
+    for p, i in events:
+        in_window[i] = in_window.get(i, 0) + 1
+        while in_window[events[left][1]] > 1:
+            in_window[events[left][1]] -= 1
+            left += 1
+        if len(in_window) == len(positions) and p - events[left][0] < window:
+            count += 1
+    return count
 
 class Searcher:
-    def __init__(self, index_path):
+    """
+    Queries one index. docs can be a DocStore shared with other searchers,
+    e.g. one per live segment, it is then left open by this one.
+    """
+    def __init__(self, index_path, doc_store_path=DOC_STORE_FILE, lexicon_path=LEXICON_FILE,
+                 postings_cache_mb=POSTINGS_CACHE_MB, result_cache_mb=RESULT_CACHE_MB, docs=None):
         self.index_path = index_path
-        self.term_offsets = {}
+        self.postings_cache = LRUCache(int(postings_cache_mb * 1024 * 1024), sizeof_arrays)
+        self.result_cache = LRUCache(int(result_cache_mb * 1024 * 1024), sizeof_results)
+        # term -> postings location lives on disk, nothing is scanned at startup
+        self.lexicon = Lexicon(lexicon_path)
+        self.owns_docs = docs is None
+        self.docs = DocStore(doc_store_path) if docs is None else docs
+        # docids left out of results, see set_deleted
+        self.deleted = frozenset()
 
-        self.ps = PorterStemmer()
+        tokenizer.stem_cache.load(tokenizer.STEM_TABLE_FILE)
 
-        self.index_file = open(self.index_path, 'r', encoding='utf-8')
-        self._build_seek_index()
+        self.index_file = open(self.index_path, 'rb')
+        self.index_map = mmap.mmap(self.index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        # positions are read in place for the documents that pass the AND
+        if self.lexicon.positional:
+            self.positions_file = open(positions_path(self.index_path), 'rb')
+            self.positions_map = mmap.mmap(self.positions_file.fileno(), 0, access=mmap.ACCESS_READ)
 
-    def _build_seek_index(self):
+    def get_postings(self, term):
         """
-        Step 1: Store the byte offset of each term
+        Step 1: Retrieve postings list for a single term
         """
-        print("Step 1: Storing byte offsets...")
-        while True:
-            offset = self.index_file.tell()
-            line = self.index_file.readline()
-            if not line:
-                break
+        entry = self.lexicon.lookup(term)
+        if entry is None:
+            return []
 
-            parts = line.split('\t', 1)
-            if len(parts) == 2:
-                self.term_offsets[parts[0]] = offset
+        offset, length, _, _ = entry
+        return decode_postings(self.index_map[offset:offset + length])
 
-    def get_postings(self, term):
+    def get_url(self, docid):
         """
-        Step 2: Retrieve postings list for a single term
+        Resolve a docid through the doc store, only done for shown results
         """
-        if term not in self.term_offsets:
-            return []
+        return self.docs.url(docid)
 
-        self.index_file.seek(self.term_offsets[term])
-        line = self.index_file.readline()
-        _, postings_str = line.strip().split('\t', 1)
-        return json.loads(postings_str)
+    def open_postings(self, term, entry=None):
+        """
+        Cursor over a term's postings. With the postings cache on, lists are
+        decoded whole into compact arrays and kept for later queries,
+        otherwise the cursor decodes one skip block at a time.
+        """
+        cached = self.postings_cache.get(term)
+        if cached is not None:
+            return PostingsList.from_arrays(*cached)
+
+        if entry is None:
+            entry = self.lexicon.lookup(term)
+        if entry is None:
+            return None
+
+        offset, length, _, _ = entry
+        data = self.index_map[offset:offset + length]
+        if not self.postings_cache.budget:
+            return PostingsList(data)
+        docids, freqs = decode_postings_arrays(data)
+        arrays = (array('I', docids), array('I', freqs))
+        self.postings_cache.put(term, arrays)
+        return PostingsList.from_arrays(*arrays)
+
+    def cache_stats(self) -> str:
+        return (f"postings cache: {self.postings_cache.info()}\n"
+                f"result cache: {self.result_cache.info()}")
+
+    def set_deleted(self, docids):
+        """
+        Hides deleted documents whose postings are still in the index,
+        until compaction drops them
+        """
+        docids = frozenset(docids)
+        if docids != self.deleted:
+            self.deleted = docids
+            self.result_cache.clear()
+
+    def open_positions(self, term):
+        location = self.lexicon.lookup_positions(term)
+        if location is None:
+            return None
+        return PositionsReader(self.positions_map, location[0])
+
+    def intersect(self, lists):
+        """
+        Step 2: AND merge all postings lists at once.
+        Returns (docid, freq) with the freq from the shortest list.
+        """
+        lists = sorted(lists, key=len)
+        return [(docid, lists[0].freq()) for docid in self.matches(lists)]
 
-    def intersect(self, p1, p2):
+    def matches(self, lists):
         """
-        Step 3: AND merge two sorted postings
-        O(N + M)
+        Yields every docid in all of the lists, with each list's cursor on it.
+        The candidate comes from whichever list is furthest ahead and every
+        other list jumps to it with next_geq (skips, then galloping inside a
+        block), so a short list against a long one touches few long blocks.
+        Shortest list first is fastest, it is the one advanced after a match.
         """
+        n = len(lists)
+        candidate = lists[0].docid
+        matched = 1
+        i = 1 % n
+        while candidate is not None:
+            if matched == n:
+                yield candidate
+                candidate = lists[0].advance()
+                matched = 1
+                i = 1 % n
+                continue
+            docid = lists[i].next_geq(candidate)
+            if docid is None:
+                break
+            if docid == candidate:
+                matched += 1
+            else:
+                candidate = docid
+                matched = 1
+            i = (i + 1) % n
+
+    def phrase_intersect(self, cursors: dict, phrases: list):
+        """
+        Positional intersection: the docid AND over every term runs first and
+        only the documents it finds have their positions decoded, each
+        term's once per document. Returns (docid, phrase matches) for the
+        documents where every phrase matches.
+        """
+        # proximity asks for each term once
+        phrases = [(phrase if slop is None else tuple(dict.fromkeys(phrase)), slop)
+                   for phrase, slop in phrases]
+        readers = {term: self.open_positions(term) for phrase, _ in phrases for term in phrase}
+        lists = sorted(cursors.values(), key=len)
         answer = []
-        i = 0
-        j = 0
-        while i < len (p1) and j < len(p2):
-            if p1[i][0] == p2[j][0]: # docid1 vs docid2
-                answer.append(p1[i])
-                i+=1
-                j+=1
-            elif p1[i][0] < p2[j][0]:
-                i+=1
+        for docid in self.matches(lists):
+            positions = {}
+
+            def term_positions(term):
+                if term not in positions:
+                    positions[term] = readers[term].positions(cursors[term].rank())
+                return positions[term]
+
+            total = 0
+            for phrase, slop in phrases:
+                count = count_phrase(map(term_positions, phrase), slop)
+                if not count:
+                    break
+                total += count
             else:
-                j+=1
+                answer.append((docid, total))
         return answer
 
     def search(self, query: str):
         """
-        Process query as series of ANDs
+        Process query as an AND of all terms. Quoted phrases must also match
+        as phrases, or within the window of a "..."~N proximity query, and
+        then the freq is the number of phrase matches.
         """
-        terms = query.lower().split()
-        if not terms:
+        terms, phrases = parse_query(query)
+        all_terms = set(terms).union(*(phrase for phrase, _ in phrases))
+        if not all_terms:
             return []
+        if phrases and not self.lexicon.positional:
+            raise ValueError(f"{self.index_path} has no positions, rebuild it with build_index.py --positions")
+
+        # AND ignores order and repeats, phrases don't
+        key = ("and", tuple(sorted(all_terms)), tuple(phrases))
+        cached = self.result_cache.get(key) if self.result_cache.budget else None
+        if cached is not None:
+            return list(cached)
+
+        cursors = {}
+        for term in key[1]:
+            postings = self.open_postings(term)
+            if postings is None:
+                cursors = None
+                break
+            cursors[term] = postings
+
+        if not cursors:
+            result = []
+        elif phrases:
+            result = self.phrase_intersect(cursors, phrases)
+        else:
+            result = self.intersect(list(cursors.values()))
+        if self.deleted:
+            result = [r for r in result if r[0] not in self.deleted]
+        if self.result_cache.budget:
+            self.result_cache.put(key, result)
+        return list(result)
 
-        stemmed_terms = [self.ps.stem(term) for term in terms]
+    def rank(self, query: str, k: int = RESULTS_TO_PRINT, dfs: dict = None):
+        """
+        Step 3: BM25 top k over the OR of the query terms, best first as
+        (docid, score). Uses MaxScore: once the k-th best score is above the
+        summed score bounds of the weakest lists, those lists stop producing
+        candidates and are only probed for documents found by the others.
+        With quoted phrases only documents that search() matches are ranked.
+        dfs overrides the lexicon's document frequencies, a shard of a
+        sharded index is given the whole index's so its scores are global.
+        """
+        bare_terms, phrases = parse_query(query)
+        terms = set(bare_terms).union(*(phrase for phrase, _ in phrases))
+        if not terms or k <= 0:
+            return []
 
-        all_postings = []
+        key = ("rank", tuple(sorted(terms)), tuple(phrases), k,
+               tuple(sorted(dfs.items())) if dfs else None)
+        cached = self.result_cache.get(key) if self.result_cache.budget else None
+        if cached is not None:
+            return list(cached)
 
-        for term in stemmed_terms:
-            posting = self.get_postings(term)
-            if not posting:
+        allowed = None
+        if phrases:
+            allowed = {docid for docid, _ in self.search(query)}
+            if not allowed:
                 return []
-            all_postings.append(posting)
 
-        all_postings.sort(key=len)
+        n_docs = len(self.docs)
+        avg_length = self.docs.avg_length or 1.0
+        # the shortest document with the highest tf gives each term's best score
+        min_norm = K1 * (1 - B + B * self.docs.min_length / avg_length)
+
+        lists = []
+        for term in terms:
+            entry = self.lexicon.lookup(term)
+            if entry is None:
+                continue
+            offset, length, df, max_tf = entry
+            if dfs:
+                df = dfs.get(term, df)
+            idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+            bound = idf * max_tf * (K1 + 1) / (max_tf + min_norm)
+            lists.append((bound, idf, self.open_postings(term, entry)))
+        if not lists:
+            return []
+
+        lists.sort(key=lambda t: t[0])
+        # bounds[i] is the most lists[0..i] together can add to a score
+        bounds = list(accumulate(t[0] for t in lists))
+        essential = 0 # lists[essential:] drive the candidates
+        heap = []
+        threshold = 0.0
 
-        result = all_postings[0]
-        for next_p in all_postings[1:]:
-            result = self.intersect(result, next_p)
-            if not result:
+        while True:
+            candidate = None
+            for i in range(essential, len(lists)):
+                docid = lists[i][2].docid
+                if docid is not None and (candidate is None or docid < candidate):
+                    candidate = docid
+            if candidate is None:
                 break
+            if (allowed is not None and candidate not in allowed) or candidate in self.deleted:
+                for i in range(essential, len(lists)):
+                    if lists[i][2].docid == candidate:
+                        lists[i][2].advance()
+                continue
+
+            norm = K1 * (1 - B + B * self.docs.length(candidate) / avg_length)
+            score = 0.0
+            for i in range(essential, len(lists)):
+                _, idf, postings = lists[i]
+                if postings.docid == candidate:
+                    tf = postings.freq()
+                    score += idf * tf * (K1 + 1) / (tf + norm)
+                    postings.advance()
+
+            # strongest non-essential list first, stop once the rest can't help
+            for i in range(essential - 1, -1, -1):
+                if score + bounds[i] <= threshold:
+                    break
+                _, idf, postings = lists[i]
+                if postings.next_geq(candidate) == candidate:
+                    tf = postings.freq()
+                    score += idf * tf * (K1 + 1) / (tf + norm)
+
+            if len(heap) < k:
+                heapq.heappush(heap, (score, -candidate))
+            elif score > threshold:
+                heapq.heapreplace(heap, (score, -candidate))
+            else:
+                continue
+
+            if len(heap) == k:
+                threshold = heap[0][0]
+                while essential < len(lists) and bounds[essential] <= threshold:
+                    essential += 1
 
-        return result
+        results = [(-neg_docid, score) for score, neg_docid in sorted(heap, reverse=True)]
+        if self.result_cache.budget:
+            self.result_cache.put(key, results)
+        return list(results)
 
     def __del__(self):
+        if hasattr(self, 'index_map'):
+            self.index_map.close()
         if hasattr(self, 'index_file'):
             self.index_file.close()
+        if hasattr(self, 'positions_map'):
+            self.positions_map.close()
+            self.positions_file.close()
+        if hasattr(self, 'docs') and self.owns_docs:
+            self.docs.close()
+        if hasattr(self, 'lexicon'):
+            self.lexicon.close()
 
 if __name__ == "__main__":
     searcher = Searcher(INDEX_FILE)
@@ -99,15 +394,19 @@ if __name__ == "__main__":
     while True:
         query = input("\nEnter search query (or 'q' to quit): ").strip()
         if query.lower() == 'q':
+            print(searcher.cache_stats())
             break
 
-        results = searcher.search(query)
+        try:
+            results = searcher.rank(query, RESULTS_TO_PRINT)
+        except ValueError as e:
+            print(e)
+            continue
 
         if not results:
             print("No documents found.")
         else:
-            print(f"Found in {len(results)} documents")
-            for doc in results[:RESULTS_TO_PRINT]:
-                print(f"DocID: {doc[0]} // Score {doc[1]} // URL: {doc[2]}")
+            for docid, score in results:
+                print(f"DocID: {docid} // Score {score:.3f} // URL: {searcher.get_url(docid)}")
 
 
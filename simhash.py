@@ -0,0 +1,110 @@
+"""
+    SimHash near duplicate detection with a banded LSH lookup table
+"""
+
+import hashlib
+from threading import Lock
+
+BITS = 64
+LANE = 32 # bits per counter lane, features per page must stay below 2**32
+LANE_MASK = (1 << LANE) - 1
+MAX_DISTANCE = 3 # differing bits still counted as a near duplicate
+SHINGLE_SIZE = 2 # tokens per feature
+TOKEN_CACHE_SIZE = 500000
+
+def _byte_spreads(j: int) -> list[int]:
+    # spread of every value of byte j of the hash, bit i of the byte -> lane 8j+i
+    return [sum(1 << ((8 * j + i) * LANE) for i in range(8) if b >> i & 1) for b in range(256)]
+
+_BYTE_SPREADS = [_byte_spreads(j) for j in range(BITS // 8)]
+
+# feature -> its 64 bit hash spread out so bit i sits at the bottom of lane i
+_spread_cache = {}
+
+def _spread(feature: str) -> int:
+    spread = _spread_cache.get(feature)
+    if spread is None:
+        # builtin hash() is salted per process, fingerprints must be stable
+        digest = hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest()
+        spread = 0
+        for table, byte in zip(_BYTE_SPREADS, digest):
+            spread |= table[byte]
+        if len(_spread_cache) >= TOKEN_CACHE_SIZE:
+            _spread_cache.clear()
+        _spread_cache[feature] = spread
+    return spread
+
+def shingles(tokens: list[str], k: int = SHINGLE_SIZE) -> set[str]:
+    """
+    Distinct runs of k consecutive tokens, keeps word order in the fingerprint
+    """
+    if len(tokens) < k:
+        return {" ".join(tokens)} if tokens else set()
+    return {" ".join(tokens[i:i + k]) for i in range(len(tokens) - k + 1)}
+
+def fingerprint(features) -> int:
+    """
+    64 bit SimHash of a set of features. Bit i is set when more than half
+    of the features hash with bit i set. All 64 per-bit counts are summed
+    at once, one lane per bit of a big int.
+    """
+    total = 0
+    acc = 0
+    for feature in features:
+        acc += _spread(feature)
+        total += 1
+
+    fp = 0
+    for i in range(BITS):
+        if 2 * ((acc >> (i * LANE)) & LANE_MASK) > total:
+            fp |= 1 << i
+    return fp
+
+def distance(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+class SimHashIndex:
+    """
+    Fingerprints are split into max_distance + 1 bands and bucketed by each
+    band. Two fingerprints within max_distance bits must agree on at least
+    one whole band, so only those buckets are compared.
+    """
+    def __init__(self, max_distance: int = MAX_DISTANCE):
+        self.max_distance = max_distance
+        self.bands = max_distance + 1
+        self.band_bits = -(-BITS // self.bands)
+        self.band_mask = (1 << self.band_bits) - 1
+        self.tables = [{} for _ in range(self.bands)]
+        self.count = 0
+        self.lock = Lock()
+
+    def __len__(self):
+        return self.count
+
+    def _keys(self, fp: int):
+        return [(fp >> (band * self.band_bits)) & self.band_mask for band in range(self.bands)]
+
+    def find(self, fp: int):
+        """
+        Returns an indexed fingerprint within max_distance of fp, or None
+        """
+        for table, key in zip(self.tables, self._keys(fp)):
+            for other in table.get(key, ()):
+                if distance(fp, other) <= self.max_distance:
+                    return other
+        return None
+
+    def add(self, fp: int):
+        for table, key in zip(self.tables, self._keys(fp)):
+            table.setdefault(key, []).append(fp)
+        self.count += 1
+
+    def check_and_add(self, fp: int) -> bool:
+        """
+        True if fp is a near duplicate of an indexed page, otherwise indexes it
+        """
+        with self.lock:
+            if self.find(fp) is not None:
+                return True
+            self.add(fp)
+            return False
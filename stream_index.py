@@ -0,0 +1,172 @@
+"""
+    Crawl-time indexing: the scraper hands each kept page's visible text to
+    a consumer process that spills index segments while the crawl runs
+"""
+
+import os
+import queue
+import time
+from threading import Lock
+from multiprocessing import Process, Queue
+
+from posting import add_postings, add_positional_postings
+from docstore import DocStoreWriter, DOC_STORE_FILE, SIGNATURE_FILE, write_signatures
+from lexicon import LEXICON_FILE
+from merge import (Segment, merge_runs, write_segment, write_build_time, clear_segments, positions_path,
+                   INDEX_FILE, POSITIONS_FILE, SEGMENT_DIR, BUILD_TIME_FILE)
+from build_index import parse_text
+import live_index
+import tokenizer
+from utils import get_logger
+
+STREAM_QUEUE_SIZE = 1000 # pages waiting to be indexed before the scraper blocks
+STREAM_MEMORY_MB = 256 # estimated in-memory index size that triggers a spill
+STREAM_DIR = "index_stream" # the crawl's segments, doc store and index until swapped in
+PUT_TIMEOUT = 1.0 # seconds a blocked submit waits before checking the indexer is alive
+
+def clear_stream():
+    """
+    Leftovers of a crawl whose indexer was killed
+    """
+    if not os.path.exists(STREAM_DIR):
+        os.makedirs(STREAM_DIR)
+    for f in os.listdir(STREAM_DIR):
+        os.remove(os.path.join(STREAM_DIR, f))
+
+def swap_in(positional: bool):
+    """
+    Replaces the index in the working directory with the one built in
+    STREAM_DIR. Segments and live updates of the old index go first, they
+    belong to its docids.
+    """
+    clear_segments()
+    moves = [(INDEX_FILE, INDEX_FILE), (LEXICON_FILE, LEXICON_FILE), (DOC_STORE_FILE, DOC_STORE_FILE),
+             (SIGNATURE_FILE, SIGNATURE_FILE), (BUILD_TIME_FILE, BUILD_TIME_FILE)]
+    if positional:
+        moves.append((positions_path(INDEX_FILE), POSITIONS_FILE))
+    elif os.path.exists(POSITIONS_FILE):
+        os.remove(POSITIONS_FILE)
+    for staged, path in moves:
+        os.replace(os.path.join(STREAM_DIR, staged), path)
+
+def queued_pages(queue: Queue):
+    while True:
+        page = queue.get()
+        if page is None:
+            return
+        yield page
+
+def index_stream(queue: Queue, memory_mb: float = STREAM_MEMORY_MB, positions: bool = False,
+                 resume: bool = False):
+    """
+    Step 1: takes (url, text) pages off the queue until None arrives,
+    docids are handed out in arrival order.
+    Step 2: spills a segment whenever the index's estimated size reaches memory_mb.
+    Step 3: merges the segments into a master index and its lexicon.
+    Everything is written under STREAM_DIR and swapped in at the end, so the
+    existing index stays searchable during the crawl and a killed indexer
+    leaves it alone. With positions the index is positional, as
+    build_index --positions.
+    A resumed crawl only sees its own pages, so with resume and an existing
+    index they are added to it as delta segments (live_index.add_pages),
+    positional if the index is. They show up in one manifest commit at the end.
+    """
+    if resume and os.path.exists(DOC_STORE_FILE):
+        live_index.add_pages(queued_pages(queue), live_index.parse_page, memory_mb)
+        return
+    started = time.time()
+    clear_stream()
+    Index = {}
+    budget = memory_mb * 1024 * 1024
+    estimate = 0
+    names = []
+    signatures = [] # for live_index to dedup a resumed crawl against
+    add = add_positional_postings if positions else add_postings
+    with DocStoreWriter(os.path.join(STREAM_DIR, DOC_STORE_FILE)) as docs:
+        for url, text in queued_pages(queue):
+            url, hash_val, length, frequency, fingerprint = parse_text(url, text, positions)
+            docid = docs.add(url, length)
+            signatures.append((bytes.fromhex(hash_val), fingerprint))
+            estimate += add(Index, docid, frequency)
+            if estimate >= budget:
+                names.append(f"index_0_{len(names) + 1}")
+                write_segment(Index, names[-1], positions, STREAM_DIR)
+                estimate = 0
+                Index.clear()
+        if Index:
+            names.append(f"index_0_{len(names) + 1}")
+            write_segment(Index, names[-1], positions, STREAM_DIR)
+        print(f"Indexed {len(docs)} pages during the crawl, {tokenizer.stem_cache.info()}")
+
+    if not names:
+        print("No pages were indexed, the existing index is kept")
+        return
+    tokenizer.stem_cache.save(tokenizer.STEM_TABLE_FILE)
+    write_signatures(signatures, os.path.join(STREAM_DIR, SIGNATURE_FILE))
+    write_build_time(started, os.path.join(STREAM_DIR, BUILD_TIME_FILE))
+    print("Merging segments...")
+    # merge passes put intermediate segments there
+    if not os.path.exists(SEGMENT_DIR):
+        os.makedirs(SEGMENT_DIR)
+    segments = [Segment(os.path.join(STREAM_DIR, f"{name}.bin"), os.path.join(STREAM_DIR, f"{name}.lex"))
+                for name in names]
+    merge_runs(segments, os.path.join(STREAM_DIR, INDEX_FILE), os.path.join(STREAM_DIR, LEXICON_FILE),
+               prefix="stream")
+    swap_in(positions)
+    clear_stream()
+    print(f"\nMerge complete! Final master index saved to {INDEX_FILE}")
+
+class StreamIndexer:
+    """
+    Bounded queue in front of an index_stream process. submit blocks while
+    the queue is full, so a slow indexer slows the crawl instead of
+    buffering pages without limit. If the process dies, streaming is turned
+    off and logged, the crawl goes on without it. With resume the pages are
+    added to the existing index, otherwise they replace it.
+    """
+    def __init__(self, queue_size: int = STREAM_QUEUE_SIZE, memory_mb: float = STREAM_MEMORY_MB,
+                 positions: bool = False, resume: bool = False):
+        self.logger = get_logger("StreamIndexer")
+        self.queue = Queue(queue_size)
+        self.process = Process(target=index_stream, args=(self.queue, memory_mb, positions, resume),
+                               daemon=True)
+        self.failed = False
+        self.lock = Lock()
+
+    def start(self):
+        self.process.start()
+
+    def put(self, item) -> bool:
+        """
+        Waits for room in the queue as long as the indexer is alive,
+        returns False once it is dead
+        """
+        while not self.failed:
+            if not self.process.is_alive():
+                with self.lock:
+                    if not self.failed:
+                        self.failed = True
+                        self.logger.error(f"Index process died (exit code {self.process.exitcode}), "
+                                          f"pages are no longer indexed during the crawl.")
+                        # nobody reads what is left, don't wait to flush it at exit
+                        self.queue.cancel_join_thread()
+                break
+            try:
+                self.queue.put(item, timeout=PUT_TIMEOUT)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def submit(self, url: str, text: str):
+        self.put((url, text))
+
+    def close(self):
+        """
+        Waits for the queued pages and the final merge
+        """
+        if self.put(None):
+            self.process.join()
+        if self.process.exitcode:
+            self.logger.error(f"Index process failed (exit code {self.process.exitcode}), "
+                              f"the existing index was kept.")
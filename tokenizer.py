@@ -2,7 +2,10 @@
 
 import sys
 import re
+import os
+import mmap
 from collections import Counter
+from nltk.stem import PorterStemmer
 
 stopwords = set("""
 i me my myself we our ours ourselves you your yours yourself yourselves he him his she her hers herself it its itself they them their theirs themselves what which who whom this that these
@@ -13,6 +16,8 @@ very s t can will just don should now
 """.split())
 
 TOKEN_PATTERN = re.compile(r"[a-z0-9\'-]+")
+STEM_CACHE_SIZE = 500000
+STEM_TABLE_FILE = "stem_table.txt"
 
 def is_number(string: str) -> bool:
     try:
@@ -31,4 +36,153 @@ def tokenize(text: str) -> list[str]:
     return tokens
 
 def compute_word_frequencies(tokens: list[str]) -> dict:
-    return dict(Counter(tokens))
\ No newline at end of file
+    return dict(Counter(tokens))
+
+class StemTable:
+    """
+    A saved stem table, sorted token<TAB>stem lines that are binary searched
+    in place through an mmap, so opening one reads nothing
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, 'rb')
+        self.version = version(os.fstat(self.file.fileno()))
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if self.version[2] else b""
+
+    def unchanged(self, path: str) -> bool:
+        """
+        True if path is still the file this table has open
+        """
+        return path == self.path and os.path.exists(path) and version(os.stat(path)) == self.version
+
+    def get(self, token: str):
+        key = token.encode('utf-8')
+        data = self.data
+        lo, hi = 0, len(data)
+        # lo is always the start of a line
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = data.rfind(b"\n", lo, mid) + 1 or lo
+            end = data.find(b"\n", start)
+            tab = data.find(b"\t", start, end)
+            found = data[start:tab]
+            if found == key:
+                return data[tab + 1:end].decode('utf-8')
+            if found < key:
+                lo = end + 1
+            else:
+                hi = start
+        return None
+
+    def items(self):
+        for line in self.data[:].splitlines():
+            token, result = line.decode('utf-8').split('\t', 1)
+            yield token, result
+
+def version(stat) -> tuple:
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+class StemCache:
+    """
+    Bounded token -> stem memo in front of PorterStemmer with hit/miss counters.
+    When full the oldest entry is dropped, dicts keep insertion order.
+    A table loaded from disk is searched on a miss before stemming.
+    """
+    def __init__(self, maxsize: int = STEM_CACHE_SIZE):
+        self.stemmer = PorterStemmer()
+        self.maxsize = maxsize
+        self.table = {}
+        self.saved = None # StemTable from load
+        self.hits = 0
+        self.misses = 0
+
+    def stem(self, token: str) -> str:
+        result = self.table.get(token)
+        if result is None and self.saved is not None:
+            result = self.saved.get(token)
+            if result is not None:
+                self.remember(token, result)
+        if result is not None:
+            self.hits += 1
+            return result
+        self.misses += 1
+        result = self.stemmer.stem(token)
+        self.remember(token, result)
+        return result
+
+    def remember(self, token: str, result: str):
+        if len(self.table) >= self.maxsize:
+            del self.table[next(iter(self.table))]
+        self.table[token] = result
+
+    def update(self, table: dict):
+        for token, result in table.items():
+            if len(self.table) >= self.maxsize:
+                break
+            self.table.setdefault(token, result)
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def info(self) -> str:
+        return (f"stem cache: {self.hits} hits, {self.misses} misses, "
+                f"{self.hit_rate():.1%} hit rate, {len(self.table)} entries")
+
+    def save(self, path: str = STEM_TABLE_FILE):
+        """
+        Writes the loaded table plus this cache's entries sorted by token,
+        renamed over path so a process that has the old one mapped keeps it
+        """
+        entries = dict(self.saved.items()) if self.saved is not None else {}
+        entries.update(self.table)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for token in sorted(entries):
+                f.write(f"{token}\t{entries[token]}\n")
+        os.replace(tmp_path, path)
+        self.load(path)
+
+    def load(self, path: str = STEM_TABLE_FILE):
+        """
+        Maps a table saved by the index build, so query stemming is a lookup.
+        Nothing is read up front and loading the same file again is a stat.
+        """
+        if not os.path.exists(path):
+            return
+        if self.saved is not None and self.saved.unchanged(path):
+            return
+        # a lookup in another thread may still hold the old one
+        self.saved = StemTable(path)
+
+# shared by build_index and search
+stem_cache = StemCache()
+
+def stem(token: str) -> str:
+    return stem_cache.stem(token)
+
+def compute_stem_frequencies(tokens: list[str]) -> dict:
+    """
+    Same as compute_word_frequencies on the stemmed tokens, but each distinct
+    token is stemmed only once
+    """
+    frequency = {}
+    for token, count in Counter(tokens).items():
+        stemmed = stem_cache.stem(token)
+        frequency[stemmed] = frequency.get(stemmed, 0) + count
+    return frequency
+
+def compute_stem_positions(tokens: list[str]) -> dict:
+    """
+    Stem -> ascending positions in tokens, for a positional index. Stop
+    words are already gone, so a phrase matches across them.
+    """
+    stems = {token: stem_cache.stem(token) for token in set(tokens)}
+    positions = {}
+    for i, token in enumerate(tokens):
+        stemmed = stems[token]
+        if stemmed in positions:
+            positions[stemmed].append(i)
+        else:
+            positions[stemmed] = [i]
+    return positions
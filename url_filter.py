@@ -0,0 +1,153 @@
+"""
+    Compiled and memoized url filter behind scraper.is_valid
+"""
+
+import re
+from urllib.parse import urlsplit
+
+ALLOWED_SUFFIXES = frozenset((
+    ".ics.uci.edu",
+    ".cs.uci.edu",
+    ".informatics.uci.edu",
+    ".stat.uci.edu",
+))
+BLOCKED_HOSTS = frozenset((
+    "grape.ics.uci.edu",
+    "calendar.ics.uci.edu",
+    "intranet.ics.uci.edu",
+    "login.uci.edu",
+    "auth.uci.edu",
+    "mail.ics.uci.edu",
+    "webmail.uci.edu",
+    "bugs.ics.uci.edu",
+    "jira.ics.uci.edu",
+))
+BLOCKED_PREFIXES = ("grape.",)
+MAX_URL_LENGTH = 300 # very long urls are usually traps
+MAX_QUERY_PARAMS = 2 # more "=" in the query than this is a query explosion
+CACHE_SIZE = 100000 # decisions kept per cache before it is cleared
+
+FILE_EXTENSION = re.compile(
+    r"\.(?:css|js|bmp|gif|jpe?g|ico"
+    r"|png|tiff?|mid|mp2|mp3|mp4"
+    r"|wav|avi|mov|mpeg|ram|m4v|mkv|ogg|ogv|pdf|mpg"
+    r"|ps|eps|tex|ppt|pptx|doc|docx|xls|xlsx|names"
+    r"|data|dat|exe|bz2|tar|msi|bin|7z|psd|dmg|iso"
+    r"|epub|dll|cnf|tgz|sha1"
+    r"|thmx|mso|arff|rtf|jar|csv"
+    r"|rm|smil|wmv|swf|wma|zip|rar|gz)$", re.IGNORECASE)
+USER_DIR = re.compile(r"/~[^/]+/")
+DATED = re.compile(r"\d{4}[-/]\d{2}")
+DEEP_PATH = re.compile(r"(/[^/]+){10,}") # calendar loops
+DIGIT = re.compile(r"\d")
+
+def _strip_params(path: str) -> str:
+    # urlparse's path, which ends at a ";" in the last segment
+    i = path.find(";", path.rfind("/") + 1)
+    return path if i < 0 else path[:i]
+
+def _path_allowed(path: str) -> bool:
+    """
+    Path rules other than the file extension. None of them tells one digit
+    from another, so a decision holds for every path with the same template.
+    """
+    if USER_DIR.search(path):
+        return False
+    if "calendar" in path or "events" in path or "/event/" in path or "grape.ics" in path:
+        if DATED.search(path):
+            return False
+        if "tag" in path or "page" in path:
+            return False
+    if "doku.php" in path:
+        return False
+    if DEEP_PATH.search(path):
+        return False
+    return True
+
+class UrlFilter:
+    """
+    Host rules are a set of allowed domain suffixes, checked at each dot of
+    the host, plus blocked hosts and prefixes. Host decisions are cached by
+    host and path decisions by the path with its digits replaced by 0, so
+    page/2 and page/3 share one entry.
+    """
+    def __init__(self, allowed_suffixes=ALLOWED_SUFFIXES, blocked_hosts=BLOCKED_HOSTS,
+                 blocked_prefixes=BLOCKED_PREFIXES, cache_size: int = CACHE_SIZE):
+        self.allowed_suffixes = frozenset(allowed_suffixes)
+        self.blocked_hosts = frozenset(blocked_hosts)
+        self.blocked_prefixes = tuple(blocked_prefixes)
+        self.cache_size = cache_size
+        self.hosts = {}
+        self.paths = {}
+        self.hits = 0
+        self.misses = 0
+
+    def host_allowed(self, host: str) -> bool:
+        allowed = self.hosts.get(host)
+        if allowed is not None:
+            self.hits += 1
+            return allowed
+        self.misses += 1
+        allowed = host not in self.blocked_hosts \
+            and not host.startswith(self.blocked_prefixes) \
+            and any(host[i:] in self.allowed_suffixes
+                    for i, ch in enumerate(host) if ch == ".")
+        if len(self.hosts) >= self.cache_size:
+            self.hosts.clear()
+        self.hosts[host] = allowed
+        return allowed
+
+    def path_allowed(self, path: str) -> bool:
+        if FILE_EXTENSION.search(path):
+            return False
+        template = DIGIT.sub("0", path)
+        allowed = self.paths.get(template)
+        if allowed is not None:
+            self.hits += 1
+            return allowed
+        self.misses += 1
+        allowed = _path_allowed(template)
+        if len(self.paths) >= self.cache_size:
+            self.paths.clear()
+        self.paths[template] = allowed
+        return allowed
+
+    def is_valid(self, url: str) -> bool:
+        if len(url) > MAX_URL_LENGTH or "ical=" in url:
+            return False
+        try:
+            # urlsplit is cached, urlparse would split params off on each call
+            parsed = urlsplit(url)
+        except ValueError:
+            # malformed, e.g. an unclosed [ in the host
+            return False
+        if parsed.scheme not in ("http", "https"):
+            return False
+        if parsed.query.count("=") > MAX_QUERY_PARAMS:
+            return False
+        return self.host_allowed(parsed.netloc) and self.path_allowed(_strip_params(parsed.path))
+
+    def filter(self, urls) -> list:
+        """
+        The valid urls out of a page's links, in order and without repeats
+        """
+        seen = set()
+        valid = []
+        for url in urls:
+            if url not in seen:
+                seen.add(url)
+                if self.is_valid(url):
+                    valid.append(url)
+        return valid
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+url_filter = UrlFilter()
+
+def is_valid(url: str) -> bool:
+    return url_filter.is_valid(url)
+
+def filter_urls(urls) -> list:
+    return url_filter.filter(urls)
@@ -9,9 +9,23 @@ class Config(object):
         assert re.match(r"^[a-zA-Z0-9_ ,]+$", self.user_agent), "User agent should not have any special characters outside '_', ',' and 'space'"
         self.threads_count = int(config["LOCAL PROPERTIES"]["THREADCOUNT"])
         self.save_file = config["LOCAL PROPERTIES"]["SAVE"]
+        # 0 keeps the thread workers, more runs asyncio workers with that many fetches in flight
+        self.async_fetches = config["LOCAL PROPERTIES"].getint("ASYNCFETCHES", fallback=0)
+        self.parser_threads = config["LOCAL PROPERTIES"].getint("PARSERTHREADS", fallback=4)
+        # index pages as they are scraped, see stream_index.py
+        self.stream_index = config["LOCAL PROPERTIES"].getboolean("STREAMINDEX", fallback=False)
+        self.index_memory_mb = config["LOCAL PROPERTIES"].getfloat("INDEXMEMORY", fallback=256.0)
+        self.index_positions = config["LOCAL PROPERTIES"].getboolean("INDEXPOSITIONS", fallback=False)
+        # seconds between stats log lines and the local metrics port, 0 turns either off
+        self.stats_interval = config["LOCAL PROPERTIES"].getfloat("STATSINTERVAL", fallback=30.0)
+        self.metrics_port = config["LOCAL PROPERTIES"].getint("METRICSPORT", fallback=0)
 
         self.host = config["CONNECTION"]["HOST"]
         self.port = int(config["CONNECTION"]["PORT"])
+        self.connect_timeout = config["CONNECTION"].getfloat("CONNECTTIMEOUT", fallback=5.0)
+        self.read_timeout = config["CONNECTION"].getfloat("READTIMEOUT", fallback=60.0)
+        self.retries = config["CONNECTION"].getint("RETRIES", fallback=3)
+        self.backoff = config["CONNECTION"].getfloat("BACKOFF", fallback=0.5)
 
         self.seed_urls = config["CRAWLER"]["SEEDURL"].split(",")
         self.time_delay = float(config["CRAWLER"]["POLITENESS"])
@@ -1,21 +1,192 @@
 import requests
 import cbor
 import time
+import random
+import asyncio
+
+from threading import Lock
+from urllib.parse import urlencode
+from requests.adapters import HTTPAdapter
 
 from utils.response import Response
 
+ASYNC_CONNECTIONS = 100  # keep-alive connections to the cache server per client
+BACKOFF_MAX = 30.0       # cap on the sleep before one retry
+
+_session = None
+_session_lock = Lock()
+
+def get_session(config):
+    '''
+    One keep-alive session shared by all workers, with a connection pool
+    big enough that no worker waits for or throws away a connection.
+    '''
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, config.threads_count))
+            session.mount("http://", adapter)
+            _session = session
+        return _session
+
+def backoff(attempt, config):
+    # full jitter, so workers that failed together do not retry together
+    return random.uniform(0, min(BACKOFF_MAX, config.backoff * 2 ** attempt))
+
 def download(url, config, logger=None):
+    '''
+    Fetches url from the cache server. 5xx replies and connection errors
+    are retried config.retries times with jittered exponential backoff,
+    the last connection error is raised.
+    '''
     host, port = config.cache_server
-    resp = requests.get(
-        f"http://{host}:{port}/",
-        params=[("q", f"{url}"), ("u", f"{config.user_agent}")])
+    session = get_session(config)
+    start = time.perf_counter()
+    for attempt in range(config.retries + 1):
+        try:
+            resp = session.get(
+                f"http://{host}:{port}/",
+                params=[("q", f"{url}"), ("u", f"{config.user_agent}")],
+                timeout=(config.connect_timeout, config.read_timeout))
+            if resp.status_code < 500 or attempt == config.retries:
+                break
+            reason = f"status <{resp.status_code}>"
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if attempt == config.retries:
+                raise
+            reason = e
+        if logger:
+            logger.warning(f"Retrying {url} after {reason}.")
+        time.sleep(backoff(attempt, config))
+
+    response = to_response(url, resp.status_code, resp.content, logger)
+    response.attempts = attempt + 1
+    response.server_time = resp.elapsed.total_seconds()
+    response.fetch_time = time.perf_counter() - start
+    return response
+
+def to_response(url, status, content, logger=None):
+    ''' Decodes the cache server's cbor reply for url. '''
     try:
-        if resp and resp.content:
-            return Response(cbor.loads(resp.content))
+        if status < 400 and content:
+            return Response(cbor.loads(content))
     except (EOFError, ValueError) as e:
         pass
-    logger.error(f"Spacetime Response error {resp} with url {url}.")
+    if logger:
+        logger.error(f"Spacetime Response error <{status}> with url {url}.")
     return Response({
-        "error": f"Spacetime Response error {resp} with url {url}.",
-        "status": resp.status_code,
+        "error": f"Spacetime Response error <{status}> with url {url}.",
+        "status": status,
         "url": url})
+
+class AsyncCacheClient(object):
+    '''
+    Minimal HTTP/1.1 client for the cache server on asyncio streams, so one
+    event loop can keep hundreds of requests in flight. Connections are
+    kept alive and reused, at most max_connections are open at once.
+    get() returns the raw (status, body) and the attempts it took,
+    to_response does the decoding.
+    '''
+    def __init__(self, config, max_connections=ASYNC_CONNECTIONS):
+        self.config = config
+        self.host, self.port = config.cache_server
+        self.user_agent = config.user_agent
+        self.timeout = config.connect_timeout + config.read_timeout
+        self.slots = asyncio.Semaphore(max_connections)
+        self.idle = list()  # (reader, writer) of kept alive connections
+
+    async def get(self, url, logger=None):
+        '''
+        Retries like download: 5xx replies, connection errors and timeouts
+        are retried config.retries times with jittered exponential backoff,
+        the last error is raised.
+        '''
+        query = urlencode([("q", url), ("u", self.user_agent)])
+        request = (
+            f"GET /?{query} HTTP/1.1\r\n"
+            f"Host: {self.host}:{self.port}\r\n"
+            f"Connection: keep-alive\r\n\r\n").encode("ascii")
+        retries = self.config.retries
+        for attempt in range(retries + 1):
+            try:
+                async with self.slots:
+                    status, body = await asyncio.wait_for(self._send(request), self.timeout)
+                if status < 500 or attempt == retries:
+                    return status, body, attempt + 1
+                reason = f"status <{status}>"
+            except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError) as e:
+                if attempt == retries:
+                    raise
+                reason = repr(e)
+            if logger:
+                logger.warning(f"Retrying {url} after {reason}.")
+            # the connection slot is free while waiting
+            await asyncio.sleep(backoff(attempt, self.config))
+
+    async def _send(self, request):
+        reused = bool(self.idle)
+        reader, writer = self.idle.pop() if reused else await asyncio.open_connection(
+            self.host, self.port)
+        try:
+            status, body, keep_alive = await self._exchange(reader, writer, request)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            writer.close()
+            if not reused:
+                raise
+            # the server may drop an idle connection, retry once on a new one
+            reader, writer = await asyncio.open_connection(self.host, self.port)
+            try:
+                status, body, keep_alive = await self._exchange(reader, writer, request)
+            except BaseException:
+                writer.close()
+                raise
+        except BaseException:
+            # a timed out or cancelled request leaves the stream mid reply
+            writer.close()
+            raise
+        if keep_alive:
+            self.idle.append((reader, writer))
+        else:
+            writer.close()
+        return status, body
+
+    @staticmethod
+    async def _exchange(reader, writer, request):
+        writer.write(request)
+        await writer.drain()
+        status_line = await reader.readuntil(b"\r\n")
+        status = int(status_line.split()[1])
+        headers = dict()
+        while True:
+            line = await reader.readuntil(b"\r\n")
+            if line == b"\r\n":
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        keep_alive = headers.get("connection", "").lower() != "close" \
+            and not status_line.startswith(b"HTTP/1.0")
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = list()
+            while True:
+                size = int((await reader.readuntil(b"\r\n")).split(b";")[0], 16)
+                if not size:
+                    # optional trailers end with an empty line
+                    while await reader.readuntil(b"\r\n") != b"\r\n":
+                        pass
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            body = b"".join(chunks)
+        elif "content-length" in headers:
+            body = await reader.readexactly(int(headers["content-length"]))
+        else:
+            body = await reader.read()
+            keep_alive = False
+        return status, body, keep_alive
+
+    async def close(self):
+        while self.idle:
+            _, writer = self.idle.pop()
+            writer.close()
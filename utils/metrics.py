@@ -0,0 +1,145 @@
+import time
+
+from bisect import bisect_left
+from contextlib import contextmanager
+from threading import Thread, Event, Lock
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# histogram bucket upper bounds in seconds, x1.41 apart from 0.1ms to ~105s
+BUCKETS = tuple(0.0001 * 2 ** (i / 2) for i in range(41))
+
+class Histogram(object):
+    __slots__ = ["counts", "total", "n"]
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # last bucket is overflow
+        self.total = 0.0
+        self.n = 0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.total += seconds
+        self.n += 1
+
+    def percentile(self, p):
+        ''' Upper bound of the bucket holding the p-th percentile. '''
+        rank = p / 100 * self.n
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if count and seen >= rank:
+                return bound
+        return BUCKETS[-1] if self.n else 0.0
+
+class Metrics(object):
+    '''
+    Stage timers and counters shared by all workers. Recording takes one
+    uncontended lock and a bisect, so it stays on in production.
+    '''
+    def __init__(self):
+        self.lock = Lock()
+        self.histograms = dict()  # stage -> Histogram
+        self.counters = dict()    # name -> int
+        self.started = time.monotonic()
+
+    def observe(self, stage, seconds):
+        with self.lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = Histogram()
+            histogram.observe(seconds)
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def reset(self):
+        with self.lock:
+            self.histograms.clear()
+            self.counters.clear()
+            self.started = time.monotonic()
+
+    def summary(self):
+        ''' One log line: page rate, then each stage's share of the timed wall time. '''
+        with self.lock:
+            elapsed = time.monotonic() - self.started
+            pages = self.counters.get("pages", 0)
+            parts = [f"pages {pages} ({pages / elapsed if elapsed else 0:.1f}/s)"]
+            parts += [f"{name} {value}" for name, value in sorted(self.counters.items())
+                      if name != "pages"]
+            timed = sum(h.total for h in self.histograms.values()) or 1.0
+            for stage, h in sorted(self.histograms.items()):
+                parts.append(
+                    f"{stage} {h.total / timed:.0%} n={h.n} avg {1000 * h.total / h.n:.1f}ms "
+                    f"p50 {1000 * h.percentile(50):.1f}ms p99 {1000 * h.percentile(99):.1f}ms")
+        return " | ".join(parts)
+
+    def prometheus(self):
+        ''' Text exposition format, histograms with cumulative buckets. '''
+        lines = []
+        with self.lock:
+            for name, value in sorted(self.counters.items()):
+                lines.append(f"# TYPE crawler_{name}_total counter")
+                lines.append(f"crawler_{name}_total {value}")
+            lines.append("# TYPE crawler_stage_seconds histogram")
+            for stage, h in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, count in zip(BUCKETS, h.counts):
+                    cumulative += count
+                    lines.append(f'crawler_stage_seconds_bucket{{stage="{stage}",le="{bound:g}"}} {cumulative}')
+                lines.append(f'crawler_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {h.n}')
+                lines.append(f'crawler_stage_seconds_sum{{stage="{stage}"}} {h.total}')
+                lines.append(f'crawler_stage_seconds_count{{stage="{stage}"}} {h.n}')
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+
+class StatsLogger(Thread):
+    ''' Logs metrics.summary() every interval seconds until stopped. '''
+    def __init__(self, logger, interval, metrics=metrics):
+        self.logger = logger
+        self.interval = interval
+        self.metrics = metrics
+        self.stopped = Event()
+        super().__init__(daemon=True)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.logger.info(self.metrics.summary())
+
+    def stop(self):
+        self.stopped.set()
+        self.logger.info(self.metrics.summary())
+
+def serve_metrics(port, metrics=metrics):
+    '''
+    Serves metrics.prometheus() on http://127.0.0.1:port/metrics from a
+    daemon thread. Returns the server, shutdown() stops it.
+    '''
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), MetricsHandler)
+    server.daemon_threads = True
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server
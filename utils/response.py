@@ -5,6 +5,11 @@ class Response(object):
         self.url = resp_dict["url"]
         self.status = resp_dict["status"]
         self.error = resp_dict["error"] if "error" in resp_dict else None
+        # set by download: tries made, seconds until the last reply's
+        # headers, and seconds in total including retries and backoff
+        self.attempts = 0
+        self.server_time = None
+        self.fetch_time = None
         try:
             self.raw_response = (
                 pickle.loads(resp_dict["response"])